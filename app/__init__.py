@@ -1,6 +1,6 @@
 from flask import Flask, redirect, url_for, request, session
 from flask_bcrypt import Bcrypt
-from flask_login import LoginManager
+from flask_login import LoginManager, current_user
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_wtf.csrf import CSRFProtect
@@ -10,6 +10,9 @@ import os
 
 # Importer db et les modèles depuis models.py
 from models import db, User
+from app.utils.cache import cache
+from app.utils.evenements import evenements
+from app.utils.reponses import reponses
 
 # Initialisation des extensions (SANS l'application)
 bcrypt = Bcrypt()
@@ -27,6 +30,15 @@ limiter = Limiter(
     default_limits=["200 per day", "50 per hour"]
 )
 
+def cle_utilisateur():
+    """
+    Clé de limitation par utilisateur connecté : toute une clinique partage
+    souvent la même IP, la limite par IP la bloquerait en entier
+    """
+    if current_user.is_authenticated:
+        return f"utilisateur:{current_user.id}"
+    return get_remote_address()
+
 # =======================================================
 # SÉLECTEUR DE LANGUE
 # =======================================================
@@ -35,7 +47,7 @@ def get_locale():
         return session['language']
     return request.accept_languages.best_match(['fr', 'en']) or 'fr'
 
-def create_app():
+def create_app(test_config=None):
     app = Flask(__name__, 
                 template_folder='templates',
                 static_folder='static')
@@ -44,6 +56,9 @@ def create_app():
     # CHARGEMENT DE LA CONFIGURATION DEPUIS config.py
     # =======================================================
     app.config.from_object('config.Config')
+    if test_config:
+        # Tests : base SQLite temporaire, CSRF et limites désactivés...
+        app.config.update(test_config)
     
     # =======================================================
     # CRÉATION DES DOSSIERS NÉCESSAIRES
@@ -61,6 +76,9 @@ def create_app():
     csrf.init_app(app)
     mail.init_app(app)
     babel.init_app(app, locale_selector=get_locale)
+    cache.init_app(app)  # ← Cache des créneaux (Redis si REDIS_URL)
+    evenements.init_app(app)  # ← Événements en direct (pub/sub Redis si REDIS_URL)
+    reponses.init_app(app)  # ← JSON rapide (orjson) et compression gzip/brotli
     
     # =======================================================
     # CONFIGURATION DE FLASK-LOGIN
@@ -77,8 +95,16 @@ def create_app():
     # CRÉATION DES TABLES ET ADMIN PAR DÉFAUT
     # =======================================================
     with app.app_context():
+        from app.utils.migrations import appliquer_migrations, est_base_neuve
+        base_neuve = est_base_neuve()
+        
         db.create_all()
         
+        # Mettre à jour le schéma des bases existantes (index, colonnes...)
+        # Les versions appliquées indiquent les fonctionnalités disponibles
+        # (ex. recherche plein texte, migration 007)
+        app.extensions['migrations_appliquees'] = appliquer_migrations(base_neuve)
+        
         # Créer admin par défaut si aucun utilisateur n'existe
         if User.query.count() == 0:
             admin = User(
@@ -125,11 +151,12 @@ def create_app():
     # =======================================================
     # INITIALISATION DU PLANIFICATEUR DE RAPPELS SMS
     # =======================================================
-    try:
-        from app.utils.scheduler import init_scheduler
-        init_scheduler(app)
-        print("⏰ Planificateur de rappels SMS initialisé (8h tous les jours)")
-    except Exception as e:
-        print(f"⚠️ Impossible de démarrer le planificateur: {e}")
+    if not app.config.get('TESTING'):
+        try:
+            from app.utils.scheduler import init_scheduler
+            init_scheduler(app)
+            print("⏰ Planificateur de rappels SMS initialisé (8h tous les jours)")
+        except Exception as e:
+            print(f"⚠️ Impossible de démarrer le planificateur: {e}")
     
     return app
\ No newline at end of file
@@ -1,12 +1,22 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, send_file, make_response, jsonify
+from flask import (Blueprint, render_template, redirect, url_for, flash, request, send_file, make_response, jsonify,
+                   Response, stream_with_context)
 from flask_login import login_required, current_user
 from app import db, bcrypt
 from models import User, Patient, Appointment, Prescription, Clinique
 from app.utils.decorators import admin_clinique_required, medecin_required, super_admin_required
 from app.utils.pdf_generator import generer_ordonnance
+from app.utils.creneaux import invalider_creneaux
+from app.utils.statistiques import (statistiques_admin, statistiques_par_clinique, changer_statut_rdv,
+                                   invalider_statistiques)
+from app.utils.analytique import analyses_rdv, PERIODE_ANALYSE_MAX_JOURS
+from app.utils.evenements import publier_rdv
+from app.utils.reponses import invalider_calendrier
 from datetime import datetime, timedelta
+from sqlalchemy import func, case
+from sqlalchemy.orm import joinedload
 import os
 import secrets
+import zlib
 import csv
 import pandas as pd
 from io import BytesIO, StringIO
@@ -27,6 +37,7 @@ def desactiver_utilisateur(user_id):
     user = User.query.get_or_404(user_id)
     user.actif = False
     db.session.commit()
+    invalider_statistiques(user.clinique_id)
     flash(f"L'utilisateur {user.nom} a été désactivé.", "success")
     return redirect(url_for('admin.gestion_utilisateurs'))
 
@@ -37,6 +48,7 @@ def activer_utilisateur(user_id):
     user = User.query.get_or_404(user_id)
     user.actif = True
     db.session.commit()
+    invalider_statistiques(user.clinique_id)
     flash(f"L'utilisateur {user.nom} a été activé.", "success")
     return redirect(url_for('admin.gestion_utilisateurs'))
 
@@ -81,6 +93,7 @@ def ajouter_clinique():
     
     db.session.add(clinique)
     db.session.commit()
+    invalider_statistiques(clinique.id)
     
     flash(f'Clinique {nom} créée avec succès (abonnement jusqu\'au {clinique.date_fin_abonnement.strftime("%d/%m/%Y")})', 'success')
     return redirect(url_for('admin.liste_cliniques'))
@@ -96,6 +109,7 @@ def renouveler_abonnement(clinique_id):
         clinique.date_fin_abonnement = datetime.now() + timedelta(days=365)
     clinique.abonnement_actif = True
     db.session.commit()
+    invalider_statistiques(clinique.id)
     flash(f'Abonnement de {clinique.nom} renouvelé jusqu\'au {clinique.date_fin_abonnement.strftime("%d/%m/%Y")}', 'success')
     return redirect(url_for('admin.liste_cliniques'))
 
@@ -106,6 +120,7 @@ def desactiver_clinique(clinique_id):
     clinique = Clinique.query.get_or_404(clinique_id)
     clinique.abonnement_actif = False
     db.session.commit()
+    invalider_statistiques(clinique.id)
     flash(f'Clinique {clinique.nom} désactivée', 'warning')
     return redirect(url_for('admin.liste_cliniques'))
 
@@ -116,6 +131,7 @@ def activer_clinique(clinique_id):
     clinique = Clinique.query.get_or_404(clinique_id)
     clinique.abonnement_actif = True
     db.session.commit()
+    invalider_statistiques(clinique.id)
     flash(f'Clinique {clinique.nom} activée', 'success')
     return redirect(url_for('admin.liste_cliniques'))
 
@@ -187,6 +203,7 @@ def ajouter_secretaire():
     
     db.session.add(secretaire)
     db.session.commit()
+    invalider_statistiques(secretaire.clinique_id)
     
     flash(f'✅ Secrétaire {nom} ajouté(e) avec succès!', 'success')
     flash(f'📧 Email: {email} | 🔑 Mot de passe temporaire: {temp_password}', 'info')
@@ -206,6 +223,7 @@ def desactiver_secretaire(user_id):
     if secretaire.role == 'secretaire':
         secretaire.actif = False
         db.session.commit()
+        invalider_statistiques(secretaire.clinique_id)
         flash(f'Secrétaire {secretaire.nom} désactivé(e)', 'warning')
     return redirect(url_for('admin.liste_secretaires'))
 
@@ -223,6 +241,7 @@ def activer_secretaire(user_id):
     if secretaire.role == 'secretaire':
         secretaire.actif = True
         db.session.commit()
+        invalider_statistiques(secretaire.clinique_id)
         flash(f'Secrétaire {secretaire.nom} activé(e)', 'success')
     return redirect(url_for('admin.liste_secretaires'))
 
@@ -302,6 +321,7 @@ def ajouter_utilisateur():
     
     db.session.add(nouvel_utilisateur)
     db.session.commit()
+    invalider_statistiques(nouvel_utilisateur.clinique_id)
     
     flash(f'✅ Utilisateur {nom} ajouté avec succès!', 'success')
     flash(f'📧 Email: {email} | 🔑 Mot de passe temporaire: {temp_password}', 'info')
@@ -340,8 +360,12 @@ def creer_prescription(appointment_id):
         )
         
         db.session.add(prescription)
-        rdv.statut = 'termine'
+        changer_statut_rdv(rdv, 'termine')
         db.session.commit()
+        invalider_creneaux(rdv.medecin_id, rdv.date)
+        invalider_statistiques(rdv.clinique_id)
+        invalider_calendrier(rdv.clinique_id)
+        publier_rdv('rdv_statut', rdv)
         
         try:
             pdf_path = generer_ordonnance(
@@ -417,62 +441,41 @@ def statistiques():
     today = datetime.now().date()
     
     if current_user.role == 'super_admin':
-        stats = {
-            'medecins': User.query.filter_by(role='medecin').count(),
-            'medecins_actifs': User.query.filter_by(role='medecin', actif=True).count(),
-            'secretaires': User.query.filter_by(role='secretaire').count(),
-            'patients': Patient.query.count(),
-            'nouveaux_patients': Patient.query.filter(
-                Patient.date_creation >= today.replace(day=1)
-            ).count(),
-            'rdv_mois': Appointment.query.filter(
-                Appointment.date >= today.replace(day=1)
-            ).count(),
-            'rdv_annules': Appointment.query.filter_by(statut='annule').count(),
-            'rdv_aujourdhui': Appointment.query.filter_by(date=today).count(),
-            'abonnements_expires': Clinique.query.filter(
-                Clinique.date_fin_abonnement < datetime.now()
-            ).count()
-        }
-        
-        rdv_confirme = Appointment.query.filter_by(statut='confirme').count()
-        rdv_termine = Appointment.query.filter_by(statut='termine').count()
-        rdv_annule = Appointment.query.filter_by(statut='annule').count()
-        rdv_absent = Appointment.query.filter_by(statut='absent').count()
-        
+        stats = statistiques_admin(None, today, datetime.now())
     else:
-        clinique_id = current_user.clinique_id
-        
-        stats = {
-            'medecins': User.query.filter_by(role='medecin', clinique_id=clinique_id).count(),
-            'medecins_actifs': User.query.filter_by(role='medecin', clinique_id=clinique_id, actif=True).count(),
-            'secretaires': User.query.filter_by(role='secretaire', clinique_id=clinique_id).count(),
-            'patients': Patient.query.filter_by(clinique_id=clinique_id).count(),
-            'nouveaux_patients': Patient.query.filter(
-                Patient.clinique_id == clinique_id,
-                Patient.date_creation >= today.replace(day=1)
-            ).count(),
-            'rdv_mois': Appointment.query.filter(
-                Appointment.clinique_id == clinique_id,
-                Appointment.date >= today.replace(day=1)
-            ).count(),
-            'rdv_annules': Appointment.query.filter_by(clinique_id=clinique_id, statut='annule').count(),
-            'rdv_aujourdhui': Appointment.query.filter_by(clinique_id=clinique_id, date=today).count(),
-            'fin_abonnement': current_user.clinique.date_fin_abonnement if current_user.clinique else None,
-            'jours_restants': (current_user.clinique.date_fin_abonnement - datetime.now()).days if current_user.clinique and current_user.clinique.date_fin_abonnement else 0
-        }
-        
-        rdv_confirme = Appointment.query.filter_by(clinique_id=clinique_id, statut='confirme').count()
-        rdv_termine = Appointment.query.filter_by(clinique_id=clinique_id, statut='termine').count()
-        rdv_annule = Appointment.query.filter_by(clinique_id=clinique_id, statut='annule').count()
-        rdv_absent = Appointment.query.filter_by(clinique_id=clinique_id, statut='absent').count()
+        stats = statistiques_admin(current_user.clinique_id, today, datetime.now())
+        stats['fin_abonnement'] = current_user.clinique.date_fin_abonnement if current_user.clinique else None
+        stats['jours_restants'] = (current_user.clinique.date_fin_abonnement - datetime.now()).days if current_user.clinique and current_user.clinique.date_fin_abonnement else 0
     
     return render_template('admin/statistiques.html', 
                          stats=stats,
-                         rdv_confirme=rdv_confirme,
-                         rdv_termine=rdv_termine,
-                         rdv_annule=rdv_annule,
-                         rdv_absent=rdv_absent)
+                         rdv_confirme=stats['rdv_confirme'],
+                         rdv_termine=stats['rdv_termine'],
+                         rdv_annule=stats['rdv_annule'],
+                         rdv_absent=stats['rdv_absent'])
+
+@admin_bp.route('/api/analytics')
+@login_required
+@admin_clinique_required
+def api_analytics():
+    """
+    Taux d'absence / d'annulation par jour, heure, médecin et délai de réservation,
+    et volume quotidien, pour les graphiques
+    Exemple : /admin/api/analytics?from=2024-01-01&to=2024-12-31 (par défaut : 90 derniers jours)
+    """
+    today = datetime.now().date()
+    try:
+        date_fin = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else today
+        date_debut = (datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from')
+                      else date_fin - timedelta(days=89))
+    except ValueError:
+        return jsonify({'error': 'Paramètres invalides (from, to au format AAAA-MM-JJ)'}), 400
+    
+    if date_fin < date_debut or (date_fin - date_debut).days >= PERIODE_ANALYSE_MAX_JOURS:
+        return jsonify({'error': f'Période invalide (maximum {PERIODE_ANALYSE_MAX_JOURS} jours)'}), 400
+    
+    clinique_id = None if current_user.role == 'super_admin' else current_user.clinique_id
+    return jsonify(analyses_rdv(clinique_id, date_debut, date_fin))
 
 # =======================================================
 # EXPORT DES DONNÉES
@@ -547,9 +550,9 @@ def export_patients_excel():
 def export_rendez_vous_pdf():
     """Exporter la liste des rendez-vous au format PDF"""
     if current_user.role == 'super_admin':
-        rdvs = Appointment.query.order_by(Appointment.date, Appointment.heure).all()
+        rdvs = Appointment.query.order_by(Appointment.date, Appointment.debut).all()
     else:
-        rdvs = Appointment.query.filter_by(clinique_id=current_user.clinique_id).order_by(Appointment.date, Appointment.heure).all()
+        rdvs = Appointment.query.filter_by(clinique_id=current_user.clinique_id).order_by(Appointment.date, Appointment.debut).all()
     
     buffer = BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=landscape(A4))
@@ -597,37 +600,35 @@ def export_rendez_vous_pdf():
 @login_required
 @super_admin_required
 def export_statistiques():
-    """Exporter les statistiques globales au format CSV"""
-    cliniques = Clinique.query.all()
-    
-    si = StringIO()
-    cw = csv.writer(si)
-    
-    cw.writerow(['Clinique', 'Médecins', 'Patients', 'RDV total', 'RDV confirmés', 'RDV annulés', 'Taux absence', 'Abonnement fin'])
-    
-    for clinique in cliniques:
-        medecins = User.query.filter_by(role='medecin', clinique_id=clinique.id).count()
-        patients = Patient.query.filter_by(clinique_id=clinique.id).count()
-        rdv_total = Appointment.query.filter_by(clinique_id=clinique.id).count()
-        rdv_confirme = Appointment.query.filter_by(clinique_id=clinique.id, statut='confirme').count()
-        rdv_annule = Appointment.query.filter_by(clinique_id=clinique.id, statut='annule').count()
-        rdv_absent = Appointment.query.filter_by(clinique_id=clinique.id, statut='absent').count()
-        taux_absence = (rdv_absent / rdv_total * 100) if rdv_total > 0 else 0
+    """Exporter les statistiques globales au format CSV (une seule requête, envoi au fil de l'eau)"""
+    def generer():
+        si = StringIO()
+        cw = csv.writer(si)
         
-        cw.writerow([
-            clinique.nom,
-            medecins,
-            patients,
-            rdv_total,
-            rdv_confirme,
-            rdv_annule,
-            f"{taux_absence:.1f}%",
-            clinique.date_fin_abonnement.strftime('%d/%m/%Y') if clinique.date_fin_abonnement else '-'
-        ])
-    
-    output = make_response(si.getvalue())
+        cw.writerow(['Clinique', 'Médecins', 'Patients', 'RDV total', 'RDV confirmés', 'RDV annulés', 'Taux absence', 'Abonnement fin'])
+        yield si.getvalue()
+        si.seek(0)
+        si.truncate(0)
+        
+        for ligne in statistiques_par_clinique():
+            taux_absence = (ligne.rdv_absent / ligne.rdv_total * 100) if ligne.rdv_total > 0 else 0
+            
+            cw.writerow([
+                ligne.nom,
+                ligne.medecins,
+                ligne.patients,
+                ligne.rdv_total,
+                ligne.rdv_confirme,
+                ligne.rdv_annule,
+                f"{taux_absence:.1f}%",
+                ligne.date_fin_abonnement.strftime('%d/%m/%Y') if ligne.date_fin_abonnement else '-'
+            ])
+            yield si.getvalue()
+            si.seek(0)
+            si.truncate(0)
+    
+    output = Response(stream_with_context(generer()), mimetype='text/csv')
     output.headers["Content-Disposition"] = "attachment; filename=statistiques.csv"
-    output.headers["Content-type"] = "text/csv"
     return output
 
 
@@ -638,27 +639,40 @@ def export_statistiques():
 @login_required
 def liste_medecins():
     """Liste des médecins avec leurs statistiques"""
-    from datetime import datetime
-    from models import Appointment, Clinique
-    
     if current_user.role == 'super_admin':
-        medecins = User.query.filter_by(role='medecin').all()
+        medecins = User.query.options(joinedload(User.clinique)).filter_by(role='medecin').all()
         cliniques = Clinique.query.all()  # Pour le select dans le modal
     else:
         medecins = User.query.filter_by(role='medecin', clinique_id=current_user.clinique_id).all()
         cliniques = []
     
-    # Ajouter des statistiques pour chaque médecin
+    # Statistiques de tous les médecins listés en une seule requête groupée
     today = datetime.now().date()
     colors = ['#4e73df', '#1cc88a', '#e74a3b', '#f6c23e', '#36b9cc', '#5a5c69']
     
-    for m in medecins:
-        m.nb_patients = Appointment.query.filter_by(medecin_id=m.id).distinct(Appointment.patient_id).count()
-        m.nb_rdv_aujourdhui = Appointment.query.filter_by(medecin_id=m.id, date=today).count()
-        m.experience = 8
-        m.couleur = colors[hash(m.nom) % len(colors)]
-    
-    return render_template('admin/medecins.html', medecins=medecins, cliniques=cliniques)
+    stats_medecins = {
+        m.id: {
+            'nb_patients': 0,
+            'nb_rdv_aujourdhui': 0,
+            # crc32 plutôt que hash() : même couleur dans tous les workers
+            'couleur': colors[zlib.crc32((m.nom or '').encode('utf-8')) % len(colors)]
+        }
+        for m in medecins
+    }
+    if medecins:
+        rows = db.session.query(
+            Appointment.medecin_id,
+            func.count(func.distinct(Appointment.patient_id)),
+            func.coalesce(func.sum(case((Appointment.date == today, 1), else_=0)), 0)
+        ).filter(
+            Appointment.medecin_id.in_(stats_medecins)
+        ).group_by(Appointment.medecin_id)
+        for medecin_id, nb_patients, nb_rdv_aujourdhui in rows:
+            stats_medecins[medecin_id]['nb_patients'] = nb_patients
+            stats_medecins[medecin_id]['nb_rdv_aujourdhui'] = nb_rdv_aujourdhui
+    
+    return render_template('admin/medecins.html', medecins=medecins, cliniques=cliniques,
+                           stats_medecins=stats_medecins)
 
 
 @admin_bp.route('/medecins/ajouter', methods=['POST'])
@@ -724,6 +738,7 @@ def ajouter_medecin():
     
     db.session.add(medecin)
     db.session.commit()
+    invalider_statistiques(medecin.clinique_id)
     
     flash(f'✅ Médecin Dr. {prenom} {nom} ajouté avec succès!', 'success')
     flash(f'📧 Email: {email} | 🔑 Mot de passe temporaire: {temp_password}', 'info')
@@ -742,6 +757,7 @@ def desactiver_medecin(user_id):
     
     medecin.actif = False
     db.session.commit()
+    invalider_statistiques(medecin.clinique_id)
     flash(f'Médecin {medecin.prenom} {medecin.nom} désactivé', 'warning')
     return redirect(url_for('admin.liste_medecins'))
 
@@ -758,6 +774,7 @@ def activer_medecin(user_id):
     
     medecin.actif = True
     db.session.commit()
+    invalider_statistiques(medecin.clinique_id)
     flash(f'Médecin {medecin.prenom} {medecin.nom} activé', 'success')
     return redirect(url_for('admin.liste_medecins'))
 
@@ -1,12 +1,26 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, send_file, jsonify, make_response
+from flask import (Blueprint, render_template, redirect, url_for, flash, request, send_file, jsonify, make_response,
+                   Response, current_app)
 from flask_login import login_required, current_user
-from app import db
-from models import User, Patient, Appointment, Availability, Prescription
+from app import db, limiter, cle_utilisateur
+from models import (User, Patient, Appointment, Availability, AvailabilityRule, AvailabilityException, Prescription,
+                    heure_en_minutes, minutes_en_heure)
 from app.utils.decorators import medecin_required, role_required
 from app.utils.pdf_generator import generer_ordonnance
+from app.utils.creneaux import (creneaux_disponibles, creneaux_disponibles_periode, plages_recurrentes,
+                                preparer_reservation, invalider_creneaux, invalider_creneaux_medecin,
+                                PERIODE_MAX_JOURS, DUREE_MAX_RDV)
+from app.utils.statistiques import (compteurs_dashboard, ajouter_rdv_stats, changer_statut_rdv, invalider_statistiques,
+                                    en_cache)
+from app.utils.patients import (page_patients, rechercher_patients, patient_par_telephone, obtenir_ou_creer_patient,
+                                CurseurInvalide, TRIS_PATIENTS, PAR_PAGE_MAX)
+from app.utils.evenements import evenements, publier_rdv
+from app.utils.reponses import calendrier_conditionnel, invalider_calendrier
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 from datetime import datetime, timedelta
 import json
 import os
+import re
 import csv
 from io import StringIO, BytesIO
 from reportlab.lib import colors
@@ -17,6 +31,31 @@ from math import ceil
 
 appointments_bp = Blueprint('appointments', __name__)
 
+# Période maximale d'un ajout groupé de créneaux (un trimestre et plus)
+CRENEAUX_GROUPES_MAX_JOURS = 186
+
+# Décalage horaire ajouté par FullCalendar aux dates start/end (ex: +01:00)
+DECALAGE_HORAIRE = re.compile(r'[+-]\d{2}:\d{2}')
+
+
+def parse_fullcalendar_date(date_str):
+    """Date d'un paramètre start/end de FullCalendar ("2024-05-01T00:00:00+01:00"), None si invalide"""
+    if not date_str:
+        return None
+    # Enlever le décalage horaire et l'espace
+    date_str = DECALAGE_HORAIRE.sub('', date_str).replace(' ', 'T')
+    try:
+        return datetime.fromisoformat(date_str).date()
+    except ValueError:
+        return None
+
+
+def periode_fullcalendar(start, end):
+    """(start_date, end_date) de la vue affichée ; à défaut, 30 jours à partir d'aujourd'hui"""
+    start_date = parse_fullcalendar_date(start) or datetime.now().date()
+    end_date = parse_fullcalendar_date(end) or start_date + timedelta(days=30)
+    return start_date, end_date
+
 # =======================================================
 # DASHBOARD (adapté multi-cliniques)
 # =======================================================
@@ -29,89 +68,36 @@ def dashboard():
     # Pour super_admin : voit tout
     # Pour les autres : filtrer par clinique_id
     # =======================================================
-    if current_user.role == 'super_admin':
-        # Super admin voit tout
-        total_patients = Patient.query.count()
-        total_rdv_mois = Appointment.query.filter(
-            Appointment.date >= today.replace(day=1)
-        ).count()
-        
-        # Rendez-vous aujourd'hui
-        rdv_aujourdhui = Appointment.query.filter_by(date=today).order_by(Appointment.heure).all()
-        
-        # Prochains rendez-vous
-        prochains_rdv = Appointment.query.filter(
-            Appointment.date >= today,
-            Appointment.statut == 'confirme'
-        ).order_by(Appointment.date, Appointment.heure).limit(10).all()
-        
-        # Statistiques globales
-        rdv_annules = Appointment.query.filter_by(statut='annule').count()
-        rdv_absents = Appointment.query.filter_by(statut='absent').count()
-        total_rdv = Appointment.query.count()
-        taux_absence = (rdv_absents / total_rdv * 100) if total_rdv > 0 else 0
-        rdv_annules_aujourdhui = Appointment.query.filter_by(date=today, statut='annule').count()
-        total_rdv_aujourdhui = Appointment.query.filter_by(date=today).count()
-        
-    else:
-        # Utilisateur normal : filtrer par clinique
-        clinique_id = current_user.clinique_id
-        
-        total_patients = Patient.query.filter_by(clinique_id=clinique_id).count()
-        
-        total_rdv_mois = Appointment.query.filter(
-            Appointment.clinique_id == clinique_id,
-            Appointment.date >= today.replace(day=1)
-        ).count()
-        
-        # Rendez-vous aujourd'hui
-        rdv_aujourdhui = Appointment.query.filter_by(
-            clinique_id=clinique_id,
-            date=today
-        ).order_by(Appointment.heure).all()
-        
-        # Prochains rendez-vous
-        prochains_rdv = Appointment.query.filter(
-            Appointment.clinique_id == clinique_id,
-            Appointment.date >= today,
-            Appointment.statut == 'confirme'
-        ).order_by(Appointment.date, Appointment.heure).limit(10).all()
-        
-        # Statistiques
-        rdv_annules = Appointment.query.filter_by(
-            clinique_id=clinique_id,
-            statut='annule'
-        ).count()
-        
-        rdv_absents = Appointment.query.filter_by(
-            clinique_id=clinique_id,
-            statut='absent'
-        ).count()
-        
-        total_rdv = Appointment.query.filter_by(clinique_id=clinique_id).count()
-        taux_absence = (rdv_absents / total_rdv * 100) if total_rdv > 0 else 0
-        
-        rdv_annules_aujourdhui = Appointment.query.filter_by(
-            clinique_id=clinique_id,
-            date=today,
-            statut='annule'
-        ).count()
-        
-        total_rdv_aujourdhui = Appointment.query.filter_by(
-            clinique_id=clinique_id,
-            date=today
-        ).count()
+    clinique_id = None if current_user.role == 'super_admin' else current_user.clinique_id
+    
+    # Tous les compteurs en une seule requête agrégée
+    compteurs = compteurs_dashboard(clinique_id, today)
+    total_rdv = compteurs['total_rdv']
+    taux_absence = (compteurs['rdv_absents'] / total_rdv * 100) if total_rdv > 0 else 0
+    
+    rdv_query = Appointment.query.options(joinedload(Appointment.patient))
+    if clinique_id is not None:
+        rdv_query = rdv_query.filter(Appointment.clinique_id == clinique_id)
+    
+    # Rendez-vous aujourd'hui
+    rdv_aujourdhui = rdv_query.filter(Appointment.date == today).order_by(Appointment.debut).all()
+    
+    # Prochains rendez-vous
+    prochains_rdv = rdv_query.filter(
+        Appointment.date >= today,
+        Appointment.statut == 'confirme'
+    ).order_by(Appointment.date, Appointment.debut).limit(10).all()
     
     return render_template('dashboard.html',
-                         total_patients=total_patients,
-                         total_rdv_mois=total_rdv_mois,
-                         rdv_annules=rdv_annules,
-                         rdv_absents=rdv_absents,
+                         total_patients=compteurs['total_patients'],
+                         total_rdv_mois=compteurs['total_rdv_mois'],
+                         rdv_annules=compteurs['rdv_annules'],
+                         rdv_absents=compteurs['rdv_absents'],
                          taux_absence=round(taux_absence, 1),
                          rdv_aujourdhui=rdv_aujourdhui,
                          prochains_rdv=prochains_rdv,
-                         rdv_annules_aujourdhui=rdv_annules_aujourdhui,
-                         total_rdv_aujourdhui=total_rdv_aujourdhui)
+                         rdv_annules_aujourdhui=compteurs['rdv_annules_aujourdhui'],
+                         total_rdv_aujourdhui=compteurs['total_rdv_aujourdhui'])
 
 
 # =======================================================
@@ -149,6 +135,12 @@ def ajouter_patient():
     else:
         date_naissance = None
     
+    # Un seul patient par numéro dans la clinique
+    existant = patient_par_telephone(current_user.clinique_id, telephone)
+    if existant:
+        flash(f'Un patient avec ce numéro existe déjà : {existant.nom}', 'warning')
+        return redirect(url_for('appointments.liste_patients'))
+    
     # Créer le patient avec la clinique_id de l'utilisateur connecté
     patient = Patient(
         nom=nom,
@@ -159,7 +151,15 @@ def ajouter_patient():
     )
     
     db.session.add(patient)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Même numéro enregistré entre-temps (index unique clinique + numéro)
+        db.session.rollback()
+        existant = patient_par_telephone(current_user.clinique_id, telephone)
+        flash(f'Un patient avec ce numéro existe déjà : {existant.nom if existant else telephone}', 'warning')
+        return redirect(url_for('appointments.liste_patients'))
+    invalider_statistiques(patient.clinique_id)
     
     flash(f'Patient {nom} ajouté avec succès', 'success')
     return redirect(url_for('appointments.liste_patients'))
@@ -196,40 +196,37 @@ def get_disponibilites(medecin_id, date):
         if not medecin or (current_user.role != 'super_admin' and medecin.clinique_id != current_user.clinique_id):
             return {'creneaux': [], 'error': 'Médecin non autorisé'}
         
-        # Récupérer les disponibilités du médecin
-        dispos = Availability.query.filter_by(
-            medecin_id=medecin_id,
-            date=date_obj
-        ).first()
-        
-        # Récupérer les rendez-vous déjà pris
-        rdv_pris = Appointment.query.filter_by(
-            medecin_id=medecin_id,
-            date=date_obj,
-            statut='confirme'
-        ).all()
-        
-        heures_pris = [r.heure for r in rdv_pris]
-        
-        # Générer les créneaux disponibles
-        creneaux = []
-        if dispos:
-            debut = datetime.strptime(dispos.heure_debut, '%H:%M')
-            fin = datetime.strptime(dispos.heure_fin, '%H:%M')
-            duree = dispos.duree_rdv or 30
-            
-            current = debut
-            while current < fin:
-                heure_str = current.strftime('%H:%M')
-                if heure_str not in heures_pris:
-                    creneaux.append(heure_str)
-                current += timedelta(minutes=duree)
+        creneaux = creneaux_disponibles(medecin_id, date_obj)
         
         return {'creneaux': creneaux}
     except Exception as e:
         return {'creneaux': [], 'error': str(e)}
 
 
+@appointments_bp.route('/api/creneaux')
+@login_required
+def api_creneaux():
+    """
+    Créneaux libres de plusieurs médecins sur plusieurs jours en un seul appel
+    Exemple : /api/creneaux?medecins=1,2,3&from=2024-05-06&to=2024-05-12
+    """
+    try:
+        medecin_ids = [int(m) for m in request.args.get('medecins', '').split(',') if m.strip()]
+        date_debut = datetime.strptime(request.args['from'], '%Y-%m-%d').date()
+        date_fin = datetime.strptime(request.args.get('to', request.args['from']), '%Y-%m-%d').date()
+    except (KeyError, ValueError):
+        return jsonify({'creneaux': {}, 'error': 'Paramètres invalides (medecins, from, to)'}), 400
+    
+    if not medecin_ids or date_fin < date_debut or (date_fin - date_debut).days > PERIODE_MAX_JOURS:
+        return jsonify({'creneaux': {}, 'error': f'Période invalide (maximum {PERIODE_MAX_JOURS} jours)'}), 400
+    
+    # Les disponibilités sont filtrées sur la clinique de l'utilisateur
+    clinique_id = None if current_user.role == 'super_admin' else current_user.clinique_id
+    creneaux = creneaux_disponibles_periode(medecin_ids, date_debut, date_fin, clinique_id=clinique_id)
+    
+    return jsonify({'creneaux': {str(medecin_id): jours for medecin_id, jours in creneaux.items()}})
+
+
 # =======================================================
 # RÉSERVATION DE RENDEZ-VOUS
 # =======================================================
@@ -256,37 +253,19 @@ def reserver_rdv():
             flash('Médecin non autorisé', 'danger')
             return redirect(url_for('appointments.prendre_rdv'))
         
-        # Créer ou récupérer le patient
-        patient = Patient.query.filter_by(telephone=patient_tel).first()
-        if not patient:
-            patient = Patient(
-                nom=patient_nom,
-                telephone=patient_tel,
-                email=patient_email if patient_email else None,
-                clinique_id=medecin.clinique_id
-            )
-            db.session.add(patient)
+        # Créer ou récupérer le patient (même numéro dans la clinique du médecin)
+        patient, cree = obtenir_ou_creer_patient(medecin.clinique_id, patient_nom, patient_tel, patient_email)
+        
+        # Mettre à jour l'email si fourni
+        if not cree and patient_email and patient.email != patient_email:
+            patient.email = patient_email
             db.session.commit()
-        else:
-            # Vérifier que le patient est de la bonne clinique
-            if patient.clinique_id != medecin.clinique_id and current_user.role != 'super_admin':
-                flash('Ce patient n\'appartient pas à votre clinique', 'danger')
-                return redirect(url_for('appointments.prendre_rdv'))
-            
-            # Mettre à jour l'email si fourni
-            if patient_email and patient.email != patient_email:
-                patient.email = patient_email
-                db.session.commit()
-        
-        # Vérifier que le créneau est toujours disponible
-        rdv_existant = Appointment.query.filter_by(
-            medecin_id=medecin_id,
-            date=datetime.strptime(date, '%Y-%m-%d').date(),
-            heure=heure,
-            statut='confirme'
-        ).first()
         
-        if rdv_existant:
+        # Vérifier qu'aucun RDV confirmé ne chevauche le créneau demandé
+        date_obj = datetime.strptime(date, '%Y-%m-%d').date()
+        duree = preparer_reservation(medecin.id, date_obj, heure_en_minutes(heure))
+        if duree is None:
+            db.session.rollback()
             flash('Ce créneau n\'est plus disponible', 'danger')
             return redirect(url_for('appointments.prendre_rdv'))
         
@@ -295,14 +274,26 @@ def reserver_rdv():
             patient_id=patient.id,
             medecin_id=medecin_id,
             clinique_id=medecin.clinique_id,
-            date=datetime.strptime(date, '%Y-%m-%d').date(),
+            date=date_obj,
             heure=heure,
+            duree=duree,
             motif=motif,
             statut='confirme'
         )
         
         db.session.add(rdv)
-        db.session.commit()
+        try:
+            # L'index unique partiel rejette un 2e RDV confirmé sur le même créneau
+            ajouter_rdv_stats(rdv)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash('Ce créneau n\'est plus disponible', 'danger')
+            return redirect(url_for('appointments.prendre_rdv'))
+        invalider_creneaux(rdv.medecin_id, rdv.date)
+        invalider_statistiques(rdv.clinique_id)
+        invalider_calendrier(rdv.clinique_id)
+        publier_rdv('rdv_cree', rdv)
         
         # =======================================================
         # ENVOI D'EMAIL ET SMS
@@ -375,8 +366,12 @@ def annuler_rdv(rdv_id):
     date_rdv = rdv.date.strftime('%d/%m/%Y')
     heure_rdv = rdv.heure
     
-    rdv.statut = 'annule'
+    changer_statut_rdv(rdv, 'annule')
     db.session.commit()
+    invalider_creneaux(rdv.medecin_id, rdv.date)
+    invalider_statistiques(rdv.clinique_id)
+    invalider_calendrier(rdv.clinique_id)
+    publier_rdv('rdv_annule', rdv)
     
     # Envoi SMS d'annulation
     try:
@@ -428,75 +423,154 @@ def gerer_creneaux():
             clinique_id=current_user.clinique_id
         ).filter(Availability.date >= today).order_by(Availability.date).all()
     
-    return render_template('manage_slots.html', disponibilites=disponibilites)
+    # Règles récurrentes et exceptions encore en vigueur
+    regles = AvailabilityRule.query.filter(
+        db.or_(AvailabilityRule.date_fin.is_(None), AvailabilityRule.date_fin >= today)
+    )
+    exceptions = AvailabilityException.query.filter(AvailabilityException.date_fin >= today)
+    if current_user.role != 'super_admin':
+        regles = regles.filter_by(clinique_id=current_user.clinique_id)
+        exceptions = exceptions.filter_by(clinique_id=current_user.clinique_id)
+    
+    # Les administrateurs peuvent créer les créneaux de plusieurs médecins à la fois
+    medecins = []
+    if current_user.role == 'super_admin':
+        medecins = User.query.filter_by(role='medecin', actif=True).order_by(User.nom).all()
+    elif current_user.role == 'admin_clinique':
+        medecins = User.query.filter_by(
+            role='medecin',
+            actif=True,
+            clinique_id=current_user.clinique_id
+        ).order_by(User.nom).all()
+    
+    return render_template('manage_slots.html',
+                         disponibilites=disponibilites,
+                         regles=regles.order_by(AvailabilityRule.date_debut).all(),
+                         exceptions=exceptions.order_by(AvailabilityException.date_debut).all(),
+                         medecins=medecins)
 
 
 @appointments_bp.route('/creneaux/ajouter', methods=['POST'])
 @login_required
 def ajouter_creneaux():
-    """Ajouter des créneaux (avec clinique_id automatique)"""
+    """
+    Ajouter des créneaux (avec clinique_id automatique)
+    Mode groupé : si date_fin est fournie, une disponibilité est créée pour
+    chaque jour coché de la période, et pour chaque médecin sélectionné
+    (administrateurs), en une seule transaction.
+    """
     date = request.form.get('date')
+    date_fin = request.form.get('date_fin')
+    jours = request.form.getlist('jours')
     heure_debut = request.form.get('heure_debut')
     heure_fin = request.form.get('heure_fin')
     duree_rdv = request.form.get('duree_rdv', 30)
     
-    print(f"=== AJOUT CRÉNEAU ===")
-    print(f"Date: {date}")
-    print(f"Début: {heure_debut}")
-    print(f"Fin: {heure_fin}")
-    print(f"Durée: {duree_rdv}")
-    print(f"User ID: {current_user.id}")
-    print(f"User role: {current_user.role}")
-    print(f"Clinique ID: {current_user.clinique_id}")
-    
     if not all([date, heure_debut, heure_fin]):
         flash('Tous les champs sont obligatoires', 'danger')
         return redirect(url_for('appointments.gerer_creneaux'))
     
     try:
+        debut, fin = heure_en_minutes(heure_debut), heure_en_minutes(heure_fin)
+        if fin <= debut:
+            flash('L\'heure de fin doit être postérieure à l\'heure de début', 'danger')
+            return redirect(url_for('appointments.gerer_creneaux'))
+        
+        # L'insertion groupée ne passe pas par les validateurs du modèle
+        duree_rdv = int(duree_rdv)
+        if not 1 <= duree_rdv <= DUREE_MAX_RDV:
+            flash(f'Durée de RDV invalide (entre 1 et {DUREE_MAX_RDV} minutes)', 'danger')
+            return redirect(url_for('appointments.gerer_creneaux'))
+        
         date_obj = datetime.strptime(date, '%Y-%m-%d').date()
+        date_fin_obj = datetime.strptime(date_fin, '%Y-%m-%d').date() if date_fin else date_obj
         
-        # Vérifier si des créneaux existent déjà pour cette date
-        existant = Availability.query.filter_by(
-            medecin_id=current_user.id,
-            date=date_obj
-        ).first()
+        if date_fin_obj < date_obj or (date_fin_obj - date_obj).days > CRENEAUX_GROUPES_MAX_JOURS:
+            flash(f'Période invalide (maximum {CRENEAUX_GROUPES_MAX_JOURS} jours)', 'danger')
+            return redirect(url_for('appointments.gerer_creneaux'))
         
-        if existant:
-            flash('Des créneaux existent déjà pour cette date', 'warning')
+        # Jours de la période (0 = lundi) ; tous si aucun n'est coché
+        dates = [date_obj + timedelta(days=i) for i in range((date_fin_obj - date_obj).days + 1)]
+        if len(dates) > 1 and jours:
+            jours_semaine = {int(j) for j in jours}
+            dates = [d for d in dates if d.weekday() in jours_semaine]
+        
+        # Médecins concernés : soi-même, ou une sélection pour les administrateurs
+        medecin_ids = request.form.getlist('medecin_ids')
+        if medecin_ids and current_user.role in ['super_admin', 'admin_clinique']:
+            query = db.session.query(User.id, User.clinique_id).filter(
+                User.id.in_([int(m) for m in medecin_ids]),
+                User.role == 'medecin'
+            )
+            if current_user.role != 'super_admin':
+                query = query.filter(User.clinique_id == current_user.clinique_id)
+            medecins = query.all()
+        else:
+            # S'assurer que clinique_id n'est pas NULL
+            clinique_id = current_user.clinique_id
+            if not clinique_id and current_user.role != 'super_admin':
+                # Si pas de clinique, prendre la première disponible
+                from models import Clinique
+                clinique = Clinique.query.first()
+                if clinique:
+                    clinique_id = clinique.id
+                else:
+                    flash('Aucune clinique disponible. Contactez l\'administrateur.', 'danger')
+                    return redirect(url_for('appointments.gerer_creneaux'))
+            medecins = [(current_user.id, clinique_id)]
+        
+        if not dates or not medecins:
+            flash('Aucun jour ni médecin sélectionné', 'warning')
             return redirect(url_for('appointments.gerer_creneaux'))
         
-        # S'assurer que clinique_id n'est pas NULL
-        clinique_id = current_user.clinique_id
-        if not clinique_id and current_user.role != 'super_admin':
-            # Si pas de clinique, prendre la première disponible
-            from models import Clinique
-            clinique = Clinique.query.first()
-            if clinique:
-                clinique_id = clinique.id
-                print(f"⚠️ Clinique ID forcé à: {clinique_id}")
-            else:
-                flash('Aucune clinique disponible. Contactez l\'administrateur.', 'danger')
-                return redirect(url_for('appointments.gerer_creneaux'))
+        # Jours déjà configurés : une seule requête pour toute la période
+        existants = set(db.session.query(Availability.medecin_id, Availability.date).filter(
+            Availability.medecin_id.in_([medecin_id for medecin_id, _ in medecins]),
+            Availability.date >= dates[0],
+            Availability.date <= dates[-1]
+        ))
         
-        disponibilite = Availability(
-            medecin_id=current_user.id,
-            clinique_id=clinique_id,
-            date=date_obj,
-            heure_debut=heure_debut,
-            heure_fin=heure_fin,
-            duree_rdv=int(duree_rdv)
-        )
+        lignes = [
+            {
+                'medecin_id': medecin_id,
+                'clinique_id': clinique_id,
+                'date': d,
+                'debut': debut,
+                'fin': fin,
+                'duree_rdv': duree_rdv
+            }
+            for medecin_id, clinique_id in medecins
+            for d in dates
+            if (medecin_id, d) not in existants
+        ]
+        
+        if not lignes:
+            flash('Des créneaux existent déjà pour cette date', 'warning')
+            return redirect(url_for('appointments.gerer_creneaux'))
         
-        db.session.add(disponibilite)
+        # Insertion groupée (executemany) dans une seule transaction
+        db.session.execute(db.insert(Availability), lignes)
         db.session.commit()
         
-        print(f"✅ Créneau ajouté avec ID: {disponibilite.id}")
-        flash(f'Créneaux ajoutés pour le {date}', 'success')
+        if len(lignes) == 1:
+            invalider_creneaux(lignes[0]['medecin_id'], lignes[0]['date'])
+        else:
+            for medecin_id, _ in medecins:
+                invalider_creneaux_medecin(medecin_id)
+        for id_clinique in {id_clinique for _, id_clinique in medecins}:
+            invalider_calendrier(id_clinique)
+        
+        if len(dates) == 1 and len(medecins) == 1:
+            flash(f'Créneaux ajoutés pour le {date}', 'success')
+        else:
+            ignores = len(dates) * len(medecins) - len(lignes)
+            message = f'{len(lignes)} journée(s) de créneaux ajoutée(s)'
+            if ignores:
+                message += f' ({ignores} déjà configurée(s), ignorée(s))'
+            flash(message, 'success')
         
     except Exception as e:
         db.session.rollback()
-        print(f"❌ ERREUR: {str(e)}")
         flash(f'Erreur: {str(e)}', 'danger')
     
     return redirect(url_for('appointments.gerer_creneaux'))
@@ -516,12 +590,164 @@ def supprimer_creneaux(dispo_id):
         flash('Vous ne pouvez pas supprimer les créneaux d\'un autre médecin', 'danger')
         return redirect(url_for('appointments.gerer_creneaux'))
     
+    medecin_id, date_dispo, clinique_id = dispo.medecin_id, dispo.date, dispo.clinique_id
     db.session.delete(dispo)
     db.session.commit()
+    invalider_creneaux(medecin_id, date_dispo)
+    invalider_calendrier(clinique_id)
     flash('Créneaux supprimés', 'success')
     return redirect(url_for('appointments.gerer_creneaux'))
 
 
+# =======================================================
+# RÈGLES RÉCURRENTES ET EXCEPTIONS
+# =======================================================
+@appointments_bp.route('/creneaux/regles/ajouter', methods=['POST'])
+@login_required
+def ajouter_regle():
+    """Ajouter une disponibilité récurrente (ex : lun-ven 09:00-12:00)"""
+    jours = request.form.getlist('jours')
+    heure_debut = request.form.get('heure_debut')
+    heure_fin = request.form.get('heure_fin')
+    duree_rdv = request.form.get('duree_rdv', 30)
+    date_debut = request.form.get('date_debut')
+    date_fin = request.form.get('date_fin')
+    
+    if not all([jours, heure_debut, heure_fin, date_debut]):
+        flash('Les jours, les heures et la date de début sont obligatoires', 'danger')
+        return redirect(url_for('appointments.gerer_creneaux'))
+    
+    try:
+        jours_semaine = 0
+        for jour in jours:
+            jours_semaine |= 1 << int(jour)
+        date_debut = datetime.strptime(date_debut, '%Y-%m-%d').date()
+        date_fin = datetime.strptime(date_fin, '%Y-%m-%d').date() if date_fin else None
+        
+        if heure_en_minutes(heure_fin) <= heure_en_minutes(heure_debut) or (date_fin and date_fin < date_debut):
+            flash('La fin doit être postérieure au début', 'danger')
+            return redirect(url_for('appointments.gerer_creneaux'))
+        
+        duree_rdv = int(duree_rdv)
+        if not 1 <= duree_rdv <= DUREE_MAX_RDV:
+            flash(f'Durée de RDV invalide (entre 1 et {DUREE_MAX_RDV} minutes)', 'danger')
+            return redirect(url_for('appointments.gerer_creneaux'))
+        
+        regle = AvailabilityRule(
+            medecin_id=current_user.id,
+            clinique_id=current_user.clinique_id,
+            jours_semaine=jours_semaine,
+            heure_debut=heure_debut,
+            heure_fin=heure_fin,
+            duree_rdv=duree_rdv,
+            date_debut=date_debut,
+            date_fin=date_fin
+        )
+        db.session.add(regle)
+        db.session.commit()
+        invalider_creneaux_medecin(regle.medecin_id)
+        invalider_calendrier(regle.clinique_id)
+        flash('Disponibilité récurrente ajoutée', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Erreur: {str(e)}', 'danger')
+    
+    return redirect(url_for('appointments.gerer_creneaux'))
+
+
+@appointments_bp.route('/creneaux/regles/supprimer/<int:regle_id>')
+@login_required
+def supprimer_regle(regle_id):
+    """Supprimer une disponibilité récurrente"""
+    regle = AvailabilityRule.query.get_or_404(regle_id)
+    
+    if current_user.role != 'super_admin' and (regle.clinique_id != current_user.clinique_id or regle.medecin_id != current_user.id):
+        flash('Vous ne pouvez pas supprimer cette disponibilité', 'danger')
+        return redirect(url_for('appointments.gerer_creneaux'))
+    
+    medecin_id, clinique_id = regle.medecin_id, regle.clinique_id
+    db.session.delete(regle)
+    db.session.commit()
+    invalider_creneaux_medecin(medecin_id)
+    invalider_calendrier(clinique_id)
+    flash('Disponibilité récurrente supprimée', 'success')
+    return redirect(url_for('appointments.gerer_creneaux'))
+
+
+@appointments_bp.route('/creneaux/exceptions/ajouter', methods=['POST'])
+@login_required
+def ajouter_exception():
+    """Déclarer une absence (médecin) ou une fermeture (toute la clinique)"""
+    date_debut = request.form.get('date_debut')
+    date_fin = request.form.get('date_fin') or date_debut
+    motif = request.form.get('motif', '').strip()
+    toute_clinique = request.form.get('toute_clinique') == '1'
+    
+    if not date_debut:
+        flash('La date de début est obligatoire', 'danger')
+        return redirect(url_for('appointments.gerer_creneaux'))
+    
+    if toute_clinique and current_user.role not in ['super_admin', 'admin_clinique']:
+        flash('Seul un administrateur peut fermer toute la clinique', 'danger')
+        return redirect(url_for('appointments.gerer_creneaux'))
+    
+    try:
+        date_debut = datetime.strptime(date_debut, '%Y-%m-%d').date()
+        date_fin = datetime.strptime(date_fin, '%Y-%m-%d').date()
+        if date_fin < date_debut:
+            flash('La fin doit être postérieure au début', 'danger')
+            return redirect(url_for('appointments.gerer_creneaux'))
+        
+        exception = AvailabilityException(
+            medecin_id=None if toute_clinique else current_user.id,
+            clinique_id=current_user.clinique_id,
+            date_debut=date_debut,
+            date_fin=date_fin,
+            motif=motif or None
+        )
+        db.session.add(exception)
+        db.session.commit()
+        _invalider_exception(exception.medecin_id, exception.clinique_id)
+        flash('Absence enregistrée', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Erreur: {str(e)}', 'danger')
+    
+    return redirect(url_for('appointments.gerer_creneaux'))
+
+
+@appointments_bp.route('/creneaux/exceptions/supprimer/<int:exception_id>')
+@login_required
+def supprimer_exception(exception_id):
+    """Supprimer une absence ou une fermeture"""
+    exception = AvailabilityException.query.get_or_404(exception_id)
+    
+    if current_user.role != 'super_admin':
+        if exception.clinique_id != current_user.clinique_id:
+            flash('Vous ne pouvez pas supprimer cette absence', 'danger')
+            return redirect(url_for('appointments.gerer_creneaux'))
+        if exception.medecin_id != current_user.id and current_user.role != 'admin_clinique':
+            flash('Vous ne pouvez pas supprimer l\'absence d\'un autre médecin', 'danger')
+            return redirect(url_for('appointments.gerer_creneaux'))
+    
+    medecin_id, clinique_id = exception.medecin_id, exception.clinique_id
+    db.session.delete(exception)
+    db.session.commit()
+    _invalider_exception(medecin_id, clinique_id)
+    flash('Absence supprimée', 'success')
+    return redirect(url_for('appointments.gerer_creneaux'))
+
+
+def _invalider_exception(medecin_id, clinique_id):
+    """Une fermeture de clinique (medecin_id NULL) touche tous ses médecins"""
+    invalider_calendrier(clinique_id)
+    if medecin_id is not None:
+        invalider_creneaux_medecin(medecin_id)
+    else:
+        for (id_medecin,) in db.session.query(User.id).filter_by(role='medecin', clinique_id=clinique_id):
+            invalider_creneaux_medecin(id_medecin)
+
+
 # =======================================================
 # ROUTE DE TEST
 # =======================================================
@@ -553,6 +779,8 @@ def test_ajout():
         
         db.session.add(dispo)
         db.session.commit()
+        invalider_creneaux(dispo.medecin_id, dispo.date)
+        invalider_calendrier(dispo.clinique_id)
         
         return f"✅ Créneau ajouté pour {date_obj} (clinique {clinique_id})"
     except Exception as e:
@@ -565,43 +793,41 @@ def test_ajout():
 @appointments_bp.route('/api/patients')
 @login_required
 def api_patients():
-    """API pour récupérer les patients avec pagination, filtres et tri"""
+    """API pour récupérer les patients, paginée par curseur, avec filtres et tri"""
     
     # Récupérer les paramètres
-    page = int(request.args.get('page', 1))
-    per_page = int(request.args.get('per_page', 10))
     sort = request.args.get('sort', 'nom')
     dir = request.args.get('dir', 'asc')
-    search = request.args.get('search', '')
+    search = request.args.get('search', '').strip()
+    cursor = request.args.get('cursor') or None
+    try:
+        per_page = min(max(int(request.args.get('per_page', 10)), 1), PAR_PAGE_MAX)
+    except ValueError:
+        return jsonify({'patients': [], 'error': 'Paramètre per_page invalide'}), 400
+    if sort not in TRIS_PATIENTS or dir not in ('asc', 'desc'):
+        return jsonify({'patients': [], 'error': f"Tri invalide (sort parmi {', '.join(TRIS_PATIENTS)}, dir asc ou desc)"}), 400
     
     # Construire la requête de base
     query = Patient.query
+    clinique_id = None
     
     # Filtrer par clinique
     if current_user.role != 'super_admin':
-        query = query.filter_by(clinique_id=current_user.clinique_id)
+        clinique_id = current_user.clinique_id
+        query = query.filter_by(clinique_id=clinique_id)
     
-    # Recherche
+    # Recherche (index plein texte, classée par pertinence)
+    rang = None
     if search:
-        query = query.filter(
-            db.or_(
-                Patient.nom.ilike(f'%{search}%'),
-                Patient.telephone.ilike(f'%{search}%'),
-                Patient.email.ilike(f'%{search}%')
-            )
-        )
-    
-    # Compter le total avant pagination
-    total = query.count()
-    
-    # Tri
-    if dir == 'asc':
-        query = query.order_by(getattr(Patient, sort))
-    else:
-        query = query.order_by(getattr(Patient, sort).desc())
+        query, rang = rechercher_patients(query, search)
+    elif sort == 'pertinence':
+        return jsonify({'patients': [], 'error': 'Le tri par pertinence nécessite une recherche'}), 400
     
-    # Pagination
-    patients = query.offset((page - 1) * per_page).limit(per_page).all()
+    # Pagination par curseur (tri + id)
+    try:
+        patients, next_cursor = page_patients(query, sort, dir, cursor, per_page, rang)
+    except CurseurInvalide as e:
+        return jsonify({'patients': [], 'error': str(e)}), 400
     
     # Formater les résultats
     result = []
@@ -616,13 +842,20 @@ def api_patients():
             'clinique_id': p.clinique_id
         })
     
-    return jsonify({
+    reponse = {
         'patients': result,
-        'total': total,
-        'pages': ceil(total / per_page),
-        'current_page': page,
+        'next_cursor': next_cursor,
         'per_page': per_page
-    })
+    }
+    
+    # Total facultatif (?total=1), mis en cache avec les statistiques de la clinique
+    if request.args.get('total') == '1':
+        total = en_cache('patients_total', clinique_id, search,
+                         lambda: {'total': query.order_by(None).count()})['total']
+        reponse['total'] = total
+        reponse['pages'] = ceil(total / per_page)
+    
+    return jsonify(reponse)
 
 
 # =======================================================
@@ -630,72 +863,93 @@ def api_patients():
 # =======================================================
 @appointments_bp.route('/api/disponibilites')
 @login_required
+@limiter.limit(lambda: current_app.config['LIMITE_API_TEMPS_REEL'], key_func=cle_utilisateur)
+@calendrier_conditionnel
 def api_disponibilites():
     """API pour récupérer les créneaux de disponibilité au format JSON pour FullCalendar"""
-    import re
     
     start = request.args.get('start')
     end = request.args.get('end')
     medecin_filter = request.args.get('medecin', 'all')
     
-    # Fonction pour parser les dates FullCalendar
-    def parse_fullcalendar_date(date_str):
-        if not date_str:
-            return None
-        # Enlever le décalage horaire (ex: +01:00) et l'espace
-        date_str = re.sub(r'[+-]\d{2}:\d{2}', '', date_str)
-        date_str = date_str.replace(' ', 'T')
+    # Filtre médecin : 'all' ou un identifiant ; toute autre valeur ne correspond à aucun médecin
+    medecin_id = None
+    if medecin_filter != 'all':
         try:
-            return datetime.fromisoformat(date_str).date()
-        except:
-            return None
-    
-    # Convertir les dates
-    start_date = parse_fullcalendar_date(start)
-    end_date = parse_fullcalendar_date(end)
-    
-    if not start_date:
-        start_date = datetime.now().date()
-    
-    if not end_date:
-        end_date = start_date + timedelta(days=30)
-    
-    # Construire la requête de base
-    query = Availability.query
+            medecin_id = int(medecin_filter)
+        except ValueError:
+            return jsonify([])
+    
+    start_date, end_date = periode_fullcalendar(start, end)
+    
+    # Une seule requête : les plages et le nom de leur médecin (jointure)
+    query = db.session.query(
+        Availability.id,
+        Availability.medecin_id,
+        Availability.date,
+        Availability.debut,
+        Availability.fin,
+        User.nom.label('medecin_nom')
+    ).join(User, User.id == Availability.medecin_id)
     
     # Filtrer par clinique
     if current_user.role != 'super_admin':
-        query = query.filter_by(clinique_id=current_user.clinique_id)
+        query = query.filter(Availability.clinique_id == current_user.clinique_id)
     
     # Filtrer par période
     query = query.filter(Availability.date >= start_date, Availability.date <= end_date)
     
     # Filtrer par médecin
-    if medecin_filter != 'all':
-        query = query.filter_by(medecin_id=medecin_filter)
+    if medecin_id is not None:
+        query = query.filter(Availability.medecin_id == medecin_id)
     
-    disponibilites = query.order_by(Availability.date, Availability.heure_debut).all()
+    disponibilites = query.order_by(Availability.date, Availability.debut)
     
     # Formater pour FullCalendar
     result = []
     for dispo in disponibilites:
-        medecin = User.query.get(dispo.medecin_id)
-        
+        jour = dispo.date.isoformat()
         result.append({
             'id': f"dispo_{dispo.id}",
-            'title': f"Disponible - Dr. {medecin.nom}",
-            'start': f"{dispo.date.isoformat()}T{dispo.heure_debut}",
-            'end': f"{dispo.date.isoformat()}T{dispo.heure_fin}",
+            'title': f"Disponible - Dr. {dispo.medecin_nom}",
+            'start': f"{jour}T{minutes_en_heure(dispo.debut)}",
+            'end': f"{jour}T{minutes_en_heure(dispo.fin)}",
             'backgroundColor': '#6c757d',  # Gris
             'borderColor': '#6c757d',
             'display': 'background',
             'extendedProps': {
                 'type': 'disponibilite',
                 'medecin_id': dispo.medecin_id,
-                'medecin_nom': medecin.nom
+                'medecin_nom': dispo.medecin_nom
             }
         })
     
+    # Disponibilités récurrentes développées sur la période affichée
+    recurrentes = plages_recurrentes(
+        start_date, end_date,
+        medecin_ids=None if medecin_id is None else [medecin_id],
+        clinique_id=None if current_user.role == 'super_admin' else current_user.clinique_id
+    )
+    noms = dict(db.session.query(User.id, User.nom).filter(
+        User.id.in_({medecin_id for medecin_id, _ in recurrentes})
+    )) if recurrentes else {}
+    for (medecin_id, jour), plages in sorted(recurrentes.items()):
+        for debut, fin, _ in plages:
+            result.append({
+                'id': f"regle_{medecin_id}_{jour.isoformat()}_{debut}",
+                'title': f"Disponible - Dr. {noms[medecin_id]}",
+                'start': f"{jour.isoformat()}T{minutes_en_heure(debut)}",
+                'end': f"{jour.isoformat()}T{minutes_en_heure(fin)}",
+                'backgroundColor': '#6c757d',
+                'borderColor': '#6c757d',
+                'display': 'background',
+                'extendedProps': {
+                    'type': 'disponibilite',
+                    'medecin_id': medecin_id,
+                    'medecin_nom': noms[medecin_id]
+                }
+            })
+    
     return jsonify(result)
 
 
@@ -723,72 +977,61 @@ def debug_creneaux():
 # =======================================================
 @appointments_bp.route('/api/rendez-vous')
 @login_required
+@limiter.limit(lambda: current_app.config['LIMITE_API_TEMPS_REEL'], key_func=cle_utilisateur)
+@calendrier_conditionnel
 def api_rendez_vous():
     """API pour récupérer les rendez-vous au format JSON pour FullCalendar"""
-    import re
     
     start = request.args.get('start')
     end = request.args.get('end')
     medecin_filter = request.args.get('medecin', 'all')
     statut_filter = request.args.get('statut', 'all')
     
-    # Fonction pour parser les dates FullCalendar
-    def parse_fullcalendar_date(date_str):
-        if not date_str:
-            return None
-        # Enlever le décalage horaire (ex: +01:00) et l'espace
-        date_str = re.sub(r'[+-]\d{2}:\d{2}', '', date_str)
-        date_str = date_str.replace(' ', 'T')
-        try:
-            return datetime.fromisoformat(date_str).date()
-        except:
-            return None
-    
-    # Convertir les dates
-    start_date = parse_fullcalendar_date(start)
-    end_date = parse_fullcalendar_date(end)
-    
-    if not start_date:
-        start_date = datetime.now().date()
-    
-    if not end_date:
-        end_date = start_date + timedelta(days=30)
-    
-    # Construire la requête de base
-    query = Appointment.query
+    start_date, end_date = periode_fullcalendar(start, end)
+    
+    # Une seule requête : les colonnes utiles du RDV, du patient et du
+    # médecin (jointures), sans construire d'objets ORM
+    query = db.session.query(
+        Appointment.id,
+        Patient.nom.label('patient_nom'),
+        Patient.telephone.label('patient_tel'),
+        User.nom.label('medecin_nom'),
+        Appointment.date,
+        Appointment.debut,
+        Appointment.duree,
+        Appointment.statut,
+        Appointment.motif
+    ).join(Patient, Patient.id == Appointment.patient_id
+    ).join(User, User.id == Appointment.medecin_id)
     
     # Filtrer par clinique
     if current_user.role != 'super_admin':
-        query = query.filter_by(clinique_id=current_user.clinique_id)
+        query = query.filter(Appointment.clinique_id == current_user.clinique_id)
     
     # Filtrer par période
     query = query.filter(Appointment.date >= start_date, Appointment.date <= end_date)
     
     # Filtrer par médecin
     if medecin_filter != 'all':
-        query = query.filter_by(medecin_id=medecin_filter)
+        query = query.filter(Appointment.medecin_id == medecin_filter)
     
     # Filtrer par statut
     if statut_filter != 'all':
-        query = query.filter_by(statut=statut_filter)
+        query = query.filter(Appointment.statut == statut_filter)
     
-    rdvs = query.order_by(Appointment.date, Appointment.heure).all()
+    rdvs = query.order_by(Appointment.date, Appointment.debut)
     
     # Formater pour FullCalendar
     result = []
     for rdv in rdvs:
-        # Calculer l'heure de fin (par défaut 30 min)
-        heure_debut = datetime.strptime(rdv.heure, '%H:%M')
-        heure_fin = (heure_debut + timedelta(minutes=30)).strftime('%H:%M')
-        
         result.append({
             'id': rdv.id,
-            'patient_nom': rdv.patient.nom,
-            'patient_tel': rdv.patient.telephone,
-            'medecin_nom': rdv.doctor.nom,
+            'patient_nom': rdv.patient_nom,
+            'patient_tel': rdv.patient_tel,
+            'medecin_nom': rdv.medecin_nom,
             'date': rdv.date.isoformat(),
-            'heure': rdv.heure,
-            'fin': heure_fin,
+            'heure': minutes_en_heure(rdv.debut),
+            'fin': minutes_en_heure(rdv.debut + (rdv.duree or 30)),
             'statut': rdv.statut,
             'motif': rdv.motif
         })
@@ -796,6 +1039,30 @@ def api_rendez_vous():
     return jsonify(result)
 
 
+@appointments_bp.route('/api/evenements')
+@login_required
+@limiter.limit(lambda: current_app.config['LIMITE_API_TEMPS_REEL'], key_func=cle_utilisateur)
+def api_evenements():
+    """Flux Server-Sent Events des RDV créés, annulés ou modifiés dans la clinique"""
+    clinique_id = None if current_user.role == 'super_admin' else current_user.clinique_id
+    
+    # Chaque flux occupe un thread du worker : au-delà de SSE_FLUX_MAX, 503 et
+    # EventSource abandonne (pas de reconnexion) ; la page passe au sondage
+    if not evenements.reserver_flux():
+        response = jsonify({'error': 'Trop de flux ouverts, mises à jour par sondage'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '60'
+        return response
+    
+    # Sans stream_with_context : la session SQLAlchemy (et sa connexion) est
+    # libérée dès le retour de la vue, pas à la fin du flux
+    response = Response(evenements.flux(clinique_id), mimetype='text/event-stream')
+    response.call_on_close(evenements.liberer_flux)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Pas de mise en tampon par nginx
+    return response
+
+
 # =======================================================
 # PAGE DU CALENDRIER
 # =======================================================
@@ -860,7 +1127,7 @@ def export_mes_patients_csv():
 def export_mes_rendez_vous_pdf():
     """Exporter la liste des rendez-vous du médecin au format PDF"""
     # Récupérer les rendez-vous du médecin
-    rdvs = Appointment.query.filter_by(medecin_id=current_user.id).order_by(Appointment.date, Appointment.heure).all()
+    rdvs = Appointment.query.filter_by(medecin_id=current_user.id).order_by(Appointment.date, Appointment.debut).all()
     
     buffer = BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=landscape(A4))
@@ -3,6 +3,7 @@ from flask_login import login_user, current_user, logout_user, login_required
 from app import db, bcrypt, limiter
 from models import User
 from app.utils.decorators import super_admin_required
+from app.utils.reponses import invalider_calendrier
 from app.utils.logger import (
     log_successful_login, log_failed_login, log_logout,
     log_password_change, log_failed_password_change, log_account_created
@@ -216,6 +217,8 @@ def modifier_profil():
         current_user.specialite = specialite
     
     db.session.commit()
+    # Le nom d'un médecin apparaît dans les événements du calendrier
+    invalider_calendrier(current_user.clinique_id)
     flash('Profil mis à jour avec succès', 'success')
     return redirect(url_for('auth.profil'))
 
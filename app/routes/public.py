@@ -1,12 +1,21 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from app import db
-from models import Clinique, User, Availability, Appointment, Patient
-from datetime import datetime, timedelta
+from models import Clinique, User, Appointment, heure_en_minutes, minutes_en_heure
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime
 from app.utils.email_utils import envoyer_confirmation_annulation, envoyer_confirmation_rdv
 from app.utils.sms_utils import envoyer_sms_confirmation_rdv, formater_numero_senegal
+from app.utils.creneaux import creneaux_disponibles, preparer_reservation, invalider_creneaux, prochains_creneaux
+from app.utils.statistiques import ajouter_rdv_stats, changer_statut_rdv, invalider_statistiques
+from app.utils.evenements import publier_rdv
+from app.utils.reponses import invalider_calendrier
+from app.utils.patients import obtenir_ou_creer_patient
 
 public_bp = Blueprint('public', __name__)
 
+# Nombre maximum de créneaux renvoyés par la recherche du prochain créneau libre
+PROCHAINS_CRENEAUX_MAX = 20
+
 # =======================================================
 # ROUTES D'ANNULATION (existantes)
 # =======================================================
@@ -49,8 +58,12 @@ def confirmer_annulation(token):
     medecin_nom = rdv.doctor.nom
 
     # Annuler le rendez-vous
-    rdv.statut = 'annule'
+    changer_statut_rdv(rdv, 'annule')
     db.session.commit()
+    invalider_creneaux(rdv.medecin_id, rdv.date)
+    invalider_statistiques(rdv.clinique_id)
+    invalider_calendrier(rdv.clinique_id)
+    publier_rdv('rdv_annule', rdv)
 
     # Envoyer email de confirmation d'annulation
     if patient_email:
@@ -86,8 +99,10 @@ def prendre_rdv_public(slug):
         actif=True,
         clinique_id=clinique.id
     ).all()
+    specialites = sorted({medecin.specialite for medecin in medecins if medecin.specialite})
     
-    return render_template('public/prendre_rdv.html', clinique=clinique, medecins=medecins)
+    return render_template('public/prendre_rdv.html', clinique=clinique, medecins=medecins,
+                           specialites=specialites)
 
 
 @public_bp.route('/public/disponibilites/<int:medecin_id>/<date>')
@@ -99,39 +114,45 @@ def get_disponibilites_public(medecin_id, date):
         # Vérifier que le médecin existe
         medecin = User.query.get_or_404(medecin_id)
         
-        # Récupérer les disponibilités
-        dispos = Availability.query.filter_by(
-            medecin_id=medecin_id,
-            date=date_obj
-        ).first()
-        
-        # Récupérer les rendez-vous déjà pris
-        rdv_pris = Appointment.query.filter_by(
-            medecin_id=medecin_id,
-            date=date_obj,
-            statut='confirme'
-        ).all()
-        
-        heures_pris = [r.heure for r in rdv_pris]
-        
-        creneaux = []
-        if dispos:
-            debut = datetime.strptime(dispos.heure_debut, '%H:%M')
-            fin = datetime.strptime(dispos.heure_fin, '%H:%M')
-            duree = dispos.duree_rdv or 30
-            
-            current = debut
-            while current < fin:
-                heure_str = current.strftime('%H:%M')
-                if heure_str not in heures_pris:
-                    creneaux.append(heure_str)
-                current += timedelta(minutes=duree)
+        creneaux = creneaux_disponibles(medecin_id, date_obj)
         
         return {'creneaux': creneaux}
     except Exception as e:
         return {'creneaux': [], 'error': str(e)}
 
 
+@public_bp.route('/<slug>/prochains-creneaux')
+def prochains_creneaux_public(slug):
+    """API publique : premiers créneaux libres tous médecins confondus (?n=5&specialite=...)"""
+    clinique = Clinique.query.filter_by(slug=slug, abonnement_actif=True).first_or_404()
+    
+    n = request.args.get('n', 5, type=int)
+    n = max(1, min(n or 5, PROCHAINS_CRENEAUX_MAX))
+    specialite = request.args.get('specialite', '').strip()
+    
+    query = db.session.query(User.id, User.nom, User.specialite).filter(
+        User.role == 'medecin',
+        User.actif == True,
+        User.clinique_id == clinique.id
+    )
+    if specialite:
+        query = query.filter(db.func.lower(User.specialite) == specialite.lower())
+    medecins = {medecin_id: (nom, spec) for medecin_id, nom, spec in query}
+    
+    creneaux = []
+    for date_obj, debut, medecin_id in prochains_creneaux(list(medecins), n, datetime.now(), clinique_id=clinique.id):
+        nom, spec = medecins[medecin_id]
+        creneaux.append({
+            'medecin_id': medecin_id,
+            'medecin': nom,
+            'specialite': spec,
+            'date': date_obj.isoformat(),
+            'heure': minutes_en_heure(debut)
+        })
+    
+    return jsonify({'creneaux': creneaux})
+
+
 @public_bp.route('/<slug>/reserver', methods=['POST'])
 def reserver_rdv_public(slug):
     """Réservation publique de rendez-vous"""
@@ -150,27 +171,14 @@ def reserver_rdv_public(slug):
         return redirect(url_for('public.prendre_rdv_public', slug=slug))
     
     try:
-        # Créer ou récupérer le patient
-        patient = Patient.query.filter_by(telephone=patient_tel).first()
-        if not patient:
-            patient = Patient(
-                nom=patient_nom,
-                telephone=patient_tel,
-                email=patient_email if patient_email else None,
-                clinique_id=clinique.id
-            )
-            db.session.add(patient)
-            db.session.commit()
+        # Créer ou récupérer le patient (même numéro dans cette clinique)
+        patient, _ = obtenir_ou_creer_patient(clinique.id, patient_nom, patient_tel, patient_email)
         
-        # Vérifier disponibilité
-        rdv_existant = Appointment.query.filter_by(
-            medecin_id=medecin_id,
-            date=datetime.strptime(date, '%Y-%m-%d').date(),
-            heure=heure,
-            statut='confirme'
-        ).first()
-        
-        if rdv_existant:
+        # Vérifier qu'aucun RDV confirmé ne chevauche le créneau demandé
+        date_obj = datetime.strptime(date, '%Y-%m-%d').date()
+        duree = preparer_reservation(int(medecin_id), date_obj, heure_en_minutes(heure))
+        if duree is None:
+            db.session.rollback()
             flash('Ce créneau n\'est plus disponible', 'danger')
             return redirect(url_for('public.prendre_rdv_public', slug=slug))
         
@@ -179,14 +187,26 @@ def reserver_rdv_public(slug):
             patient_id=patient.id,
             medecin_id=medecin_id,
             clinique_id=clinique.id,
-            date=datetime.strptime(date, '%Y-%m-%d').date(),
+            date=date_obj,
             heure=heure,
+            duree=duree,
             motif=motif,
             statut='confirme'
         )
         
         db.session.add(rdv)
-        db.session.commit()
+        try:
+            # L'index unique partiel rejette un 2e RDV confirmé sur le même créneau
+            ajouter_rdv_stats(rdv)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash('Ce créneau n\'est plus disponible', 'danger')
+            return redirect(url_for('public.prendre_rdv_public', slug=slug))
+        invalider_creneaux(rdv.medecin_id, rdv.date)
+        invalider_statistiques(rdv.clinique_id)
+        invalider_calendrier(rdv.clinique_id)
+        publier_rdv('rdv_cree', rdv)
         
         # Envoyer confirmation
         medecin = User.query.get(medecin_id)
@@ -0,0 +1,116 @@
+import pandas as pd
+from sqlalchemy import type_coerce
+from models import db, User, Appointment
+from app.utils.statistiques import en_cache
+
+# =======================================================
+# ANALYSE DES ABSENCES ET DE LA CHARGE (pandas)
+# =======================================================
+# Les RDV de la période sont chargés en une seule requête (colonnes
+# utiles uniquement) puis agrégés de façon vectorisée : aucun calcul
+# ligne par ligne en Python. Le résultat est un JSON compact pour les
+# graphiques : pour chaque axe, des listes parallèles (labels, total,
+# taux_absence, taux_annulation).
+
+# Période maximale analysée
+PERIODE_ANALYSE_MAX_JOURS = 366
+
+JOURS_SEMAINE = ['Lundi', 'Mardi', 'Mercredi', 'Jeudi', 'Vendredi', 'Samedi', 'Dimanche']
+
+# Délai entre la prise de RDV et le RDV, en jours : tranches (a, b]
+BORNES_DELAI = [-1, 0, 1, 3, 7, 14, 30, float('inf')]
+TRANCHES_DELAI = ['Jour même', '1 jour', '2-3 jours', '4-7 jours', '8-14 jours', '15-30 jours', '> 30 jours']
+
+def _charger_rdv(clinique_id, date_debut, date_fin):
+    """RDV de la période dans un DataFrame (une requête, colonnes utiles uniquement)"""
+    # Lecture directe par pandas (sans construire d'objets ligne SQLAlchemy) ; les
+    # dates arrivent telles que renvoyées par le pilote (chaînes sous SQLite) et
+    # sont converties en bloc
+    query = db.session.query(
+        type_coerce(Appointment.date, db.String).label('date'),
+        Appointment.debut, Appointment.statut, Appointment.medecin_id,
+        type_coerce(Appointment.date_creation, db.String).label('date_creation')
+    ).filter(
+        Appointment.date >= date_debut,
+        Appointment.date <= date_fin
+    )
+    if clinique_id is not None:
+        query = query.filter(Appointment.clinique_id == clinique_id)
+
+    df = pd.read_sql(query.statement, db.session.connection())
+    df['date'] = pd.to_datetime(df['date'], format='ISO8601')
+    df['date_creation'] = pd.to_datetime(df['date_creation'], format='ISO8601')
+    df['absent'] = df['statut'] == 'absent'
+    df['annule'] = df['statut'] == 'annule'
+    return df
+
+
+def _taux_par(df, cle, index=None):
+    """Total, taux d'absence et d'annulation par valeur de cle (Series alignée sur df)"""
+    agg = df.groupby(cle, observed=False).agg(
+        total=('absent', 'size'),
+        absents=('absent', 'sum'),
+        annules=('annule', 'sum')
+    )
+    if index is not None:
+        agg = agg.reindex(index, fill_value=0)
+    total = agg['total']
+    diviseur = total.where(total > 0)
+    return {
+        'total': total.astype(int).tolist(),
+        'taux_absence': (agg['absents'] / diviseur).fillna(0).round(3).tolist(),
+        'taux_annulation': (agg['annules'] / diviseur).fillna(0).round(3).tolist()
+    }, agg.index
+
+
+def _calculer_analyses(clinique_id, date_debut, date_fin):
+    df = _charger_rdv(clinique_id, date_debut, date_fin)
+
+    # Par jour de la semaine (toujours 7 valeurs)
+    par_jour, _ = _taux_par(df, df['date'].dt.weekday, index=range(7))
+    par_jour['labels'] = JOURS_SEMAINE
+
+    # Par heure de début
+    par_heure, heures = _taux_par(df, df['debut'] // 60)
+    par_heure['labels'] = [f"{int(h):02d}h" for h in heures]
+
+    # Par médecin (noms en une requête)
+    par_medecin, medecin_ids = _taux_par(df, df['medecin_id'])
+    ids = [int(m) for m in medecin_ids]
+    noms = dict(db.session.query(User.id, User.nom).filter(User.id.in_(ids))) if ids else {}
+    par_medecin['ids'] = ids
+    par_medecin['labels'] = [noms.get(m, str(m)) for m in ids]
+
+    # Par délai de réservation (RDV sans date de création ignorés)
+    delai = (df['date'] - df['date_creation'].dt.normalize()).dt.days
+    tranches = pd.cut(delai, bins=BORNES_DELAI, labels=TRANCHES_DELAI)
+    par_delai, _ = _taux_par(df, tranches)
+    par_delai['labels'] = TRANCHES_DELAI
+
+    # Volume quotidien des RDV de la période : par date de consultation et par date de réservation
+    jours = pd.date_range(date_debut, date_fin, freq='D')
+    rdv_par_jour = df.groupby('date').size().reindex(jours, fill_value=0)
+    creations = df['date_creation'].dt.normalize()
+    reservations = creations.groupby(creations).size().reindex(jours, fill_value=0)
+
+    return {
+        'periode': {'debut': date_debut.isoformat(), 'fin': date_fin.isoformat()},
+        'total': int(len(df)),
+        'taux_absence': round(float(df['absent'].mean()), 3) if len(df) else 0,
+        'taux_annulation': round(float(df['annule'].mean()), 3) if len(df) else 0,
+        'par_jour_semaine': par_jour,
+        'par_heure': par_heure,
+        'par_medecin': par_medecin,
+        'par_delai': par_delai,
+        'volume': {
+            'dates': [jour.strftime('%Y-%m-%d') for jour in jours],
+            'rdv': rdv_par_jour.astype(int).tolist(),
+            'reservations': reservations.astype(int).tolist()
+        }
+    }
+
+
+def analyses_rdv(clinique_id, date_debut, date_fin):
+    """Analyses des RDV d'une clinique (None : toutes) sur une période, mises en cache"""
+    return en_cache('analyses', clinique_id, f"{date_debut.isoformat()}:{date_fin.isoformat()}",
+                    lambda: _calculer_analyses(clinique_id, date_debut, date_fin))
@@ -0,0 +1,130 @@
+import json
+import time
+from collections import OrderedDict
+from threading import Lock
+
+# =======================================================
+# CACHE APPLICATIF (mémoire locale ou Redis)
+# =======================================================
+# Backend choisi par init_app() :
+#   - REDIS_URL défini (le même que Flask-Limiter) -> Redis, partagé entre workers
+#   - sinon -> dictionnaire LRU borné propre à chaque processus
+# Les valeurs doivent être sérialisables en JSON.
+
+
+class CacheMemoire:
+    """Cache LRU en mémoire, borné en nombre d'entrées, avec TTL optionnel"""
+
+    def __init__(self, taille_max=10000):
+        self.taille_max = taille_max
+        self._donnees = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, cle):
+        with self._lock:
+            entree = self._donnees.get(cle)
+            if entree is None:
+                return None
+            valeur, expiration = entree
+            if expiration is not None and expiration < time.monotonic():
+                del self._donnees[cle]
+                return None
+            self._donnees.move_to_end(cle)
+            return valeur
+
+    def set(self, cle, valeur, ttl=None):
+        expiration = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._donnees[cle] = (valeur, expiration)
+            self._donnees.move_to_end(cle)
+            while len(self._donnees) > self.taille_max:
+                self._donnees.popitem(last=False)
+
+    def delete(self, *cles):
+        with self._lock:
+            for cle in cles:
+                self._donnees.pop(cle, None)
+
+    def clear(self):
+        with self._lock:
+            self._donnees.clear()
+
+
+class CacheRedis:
+    """Cache partagé entre workers ; l'éviction LRU est assurée par Redis (TTL + maxmemory-policy)"""
+
+    def __init__(self, url, prefixe='clinique-rdv:'):
+        import redis
+        self.client = redis.Redis.from_url(url, socket_timeout=1)
+        self.client.ping()
+        self.prefixe = prefixe
+
+    def get(self, cle):
+        valeur = self.client.get(self.prefixe + cle)
+        return json.loads(valeur) if valeur is not None else None
+
+    def set(self, cle, valeur, ttl=None):
+        self.client.set(self.prefixe + cle, json.dumps(valeur), ex=ttl)
+
+    def delete(self, *cles):
+        if cles:
+            self.client.delete(*[self.prefixe + cle for cle in cles])
+
+    def clear(self):
+        for cle in self.client.scan_iter(self.prefixe + '*'):
+            self.client.delete(cle)
+
+
+class Cache:
+    """Point d'accès unique au cache, initialisé comme une extension Flask"""
+
+    def __init__(self):
+        self.backend = CacheMemoire()
+
+    def init_app(self, app):
+        url = app.config.get('REDIS_URL')
+        if url and url.startswith(('redis://', 'rediss://')):
+            try:
+                self.backend = CacheRedis(url)
+                return
+            except Exception as e:
+                print(f"⚠️ Cache Redis indisponible, repli sur la mémoire locale: {e}")
+        self.backend = CacheMemoire(app.config.get('CACHE_TAILLE_MAX', 10000))
+
+    # Une panne du cache ne doit jamais faire échouer la requête
+    def get(self, cle):
+        try:
+            return self.backend.get(cle)
+        except Exception as e:
+            print(f"⚠️ Erreur lecture cache: {e}")
+            return None
+
+    def set(self, cle, valeur, ttl=None):
+        try:
+            self.backend.set(cle, valeur, ttl)
+        except Exception as e:
+            print(f"⚠️ Erreur écriture cache: {e}")
+
+    def delete(self, *cles):
+        try:
+            self.backend.delete(*cles)
+        except Exception as e:
+            print(f"⚠️ Erreur invalidation cache: {e}")
+
+    def version(self, cle, ttl=None):
+        """
+        Version courante d'un groupe d'entrées, à inclure dans leurs clés :
+        supprimer la clé de version (delete) rend tout le groupe obsolète.
+        ttl : la version change aussi d'elle-même au bout de ttl secondes
+        """
+        version = self.get(cle)
+        if version is None:
+            version = time.time_ns()
+            self.set(cle, version, ttl)
+        return version
+
+    def clear(self):
+        self.backend.clear()
+
+
+cache = Cache()
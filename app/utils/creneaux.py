@@ -0,0 +1,339 @@
+import heapq
+from bisect import bisect_left
+from collections import defaultdict
+from itertools import islice
+from datetime import timedelta
+from flask import current_app
+from models import (db, User, Availability, AvailabilityRule, AvailabilityException, Appointment,
+                    minutes_en_heure, DUREE_MAX_RDV)
+from app.utils.cache import cache
+
+# =======================================================
+# MOTEUR DE CALCUL DES CRÉNEAUX
+# =======================================================
+# Toutes les heures sont manipulées en minutes depuis minuit (entiers,
+# comme en base) : pas de conversion dans la boucle. Un créneau est libre
+# si l'intervalle [debut, debut + durée) ne chevauche aucun RDV confirmé,
+# quelle que soit la durée de ce RDV.
+
+DUREE_PAR_DEFAUT = 30
+
+# Période maximale acceptée par les recherches multi-jours
+PERIODE_MAX_JOURS = 62
+
+# Taille des fenêtres chargées par la recherche du prochain créneau libre
+FENETRE_RECHERCHE_JOURS = 7
+
+
+def generer_creneaux(plages, rdv_pris=()):
+    """
+    Calcule les créneaux libres d'une journée
+    plages : itérable de (debut, fin, duree) en minutes ; plusieurs plages
+             (éventuellement chevauchantes) sont fusionnées
+    rdv_pris : itérable de (debut, duree) des RDV confirmés
+    Retourne la liste triée des créneaux libres en minutes
+    """
+    # RDV triés par début + maximum cumulé des fins : un créneau [s, s + d)
+    # est occupé si un RDV commençant avant s + d se termine après s
+    pris = sorted((debut, debut + (duree or DUREE_PAR_DEFAUT)) for debut, duree in rdv_pris)
+    debuts = [debut for debut, _ in pris]
+    fins_max = []
+    fin_max = -1
+    for _, fin in pris:
+        fin_max = max(fin_max, fin)
+        fins_max.append(fin_max)
+    
+    libres = set()
+    for debut, fin, duree in plages:
+        duree = duree or DUREE_PAR_DEFAUT
+        if not pris:
+            libres.update(range(debut, fin, duree))
+            continue
+        # Les créneaux avancent : l'indice dans debuts ne fait qu'augmenter
+        i = bisect_left(debuts, debut + duree)
+        for creneau in range(debut, fin, duree):
+            while i < len(debuts) and debuts[i] < creneau + duree:
+                i += 1
+            if i == 0 or fins_max[i - 1] <= creneau:
+                libres.add(creneau)
+    return sorted(libres)
+
+
+def _jours(date_debut, date_fin):
+    jour = date_debut
+    while jour <= date_fin:
+        yield jour
+        jour += timedelta(days=1)
+
+
+def jours_exclus(cliniques, medecins, date_debut, date_fin):
+    """
+    Jours retirés par les exceptions sur la période : par médecin (absence)
+    et par clinique (fermeture, medecin_id NULL). S'appliquent aux
+    disponibilités ponctuelles comme aux règles récurrentes.
+    Retourne {(('medecin', id) ou ('clinique', id), date)} ; voir est_exclu()
+    """
+    exclus = set()
+    if not cliniques and not medecins:
+        return exclus
+    exceptions = db.session.query(
+        AvailabilityException.medecin_id, AvailabilityException.clinique_id,
+        AvailabilityException.date_debut, AvailabilityException.date_fin
+    ).filter(
+        AvailabilityException.date_debut <= date_fin,
+        AvailabilityException.date_fin >= date_debut,
+        db.or_(
+            db.and_(AvailabilityException.medecin_id.is_(None), AvailabilityException.clinique_id.in_(cliniques)),
+            AvailabilityException.medecin_id.in_(medecins)
+        )
+    )
+    for medecin_id, exc_clinique_id, exc_debut, exc_fin in exceptions:
+        cible = ('medecin', medecin_id) if medecin_id is not None else ('clinique', exc_clinique_id)
+        for jour in _jours(max(exc_debut, date_debut), min(exc_fin, date_fin)):
+            exclus.add((cible, jour))
+    return exclus
+
+
+def est_exclu(exclus, medecin_id, clinique_id, jour):
+    return (('medecin', medecin_id), jour) in exclus or (('clinique', clinique_id), jour) in exclus
+
+
+def plages_recurrentes(date_debut, date_fin, medecin_ids=None, clinique_id=None):
+    """
+    Développe les règles récurrentes sur la période, sans rien écrire en base
+    Les exceptions (absence d'un médecin, fermeture de la clinique) retirent
+    les jours concernés.
+    Retourne {(medecin_id, date): [(debut, fin, duree), ...]}
+    """
+    query = db.session.query(
+        AvailabilityRule.medecin_id, AvailabilityRule.clinique_id, AvailabilityRule.jours_semaine,
+        AvailabilityRule.debut, AvailabilityRule.fin, AvailabilityRule.duree_rdv,
+        AvailabilityRule.date_debut, AvailabilityRule.date_fin
+    ).filter(
+        AvailabilityRule.date_debut <= date_fin,
+        db.or_(AvailabilityRule.date_fin.is_(None), AvailabilityRule.date_fin >= date_debut)
+    )
+    if medecin_ids is not None:
+        query = query.filter(AvailabilityRule.medecin_id.in_(medecin_ids))
+    if clinique_id is not None:
+        query = query.filter(AvailabilityRule.clinique_id == clinique_id)
+    regles = query.all()
+    if not regles:
+        return {}
+
+    exclus = jours_exclus({regle.clinique_id for regle in regles}, {regle.medecin_id for regle in regles},
+                          date_debut, date_fin)
+
+    plages = defaultdict(list)
+    for medecin_id, regle_clinique_id, jours_semaine, debut, fin, duree, regle_debut, regle_fin in regles:
+        plage = (debut, fin, duree)
+        for jour in _jours(max(regle_debut, date_debut), min(regle_fin or date_fin, date_fin)):
+            if not jours_semaine >> jour.weekday() & 1:
+                continue
+            if est_exclu(exclus, medecin_id, regle_clinique_id, jour):
+                continue
+            plages[(medecin_id, jour)].append(plage)
+    return plages
+
+
+def plages_du_jour(medecin_id, date_obj):
+    """
+    Plages de disponibilité (en minutes) d'un médecin pour une date :
+    ponctuelles + récurrentes, hors absences et fermetures
+    """
+    rows = db.session.query(
+        Availability.clinique_id, Availability.debut, Availability.fin, Availability.duree_rdv
+    ).filter_by(medecin_id=medecin_id, date=date_obj).all()
+    exclus = jours_exclus({row.clinique_id for row in rows}, {medecin_id}, date_obj, date_obj) if rows else set()
+    plages = [(debut, fin, duree) for clinique_id, debut, fin, duree in rows
+              if not est_exclu(exclus, medecin_id, clinique_id, date_obj)]
+    plages.extend(plages_recurrentes(date_obj, date_obj, medecin_ids=[medecin_id]).get((medecin_id, date_obj), []))
+    return plages
+
+
+def rdv_pris_du_jour(medecin_id, date_obj):
+    """(debut, duree) des rendez-vous confirmés d'un médecin pour une date"""
+    return db.session.query(Appointment.debut, Appointment.duree).filter_by(
+        medecin_id=medecin_id,
+        date=date_obj,
+        statut='confirme'
+    ).all()
+
+
+def duree_en_vigueur(medecin_id, date_obj, debut):
+    """Durée de RDV de la plage de disponibilité qui contient l'heure demandée"""
+    for plage_debut, plage_fin, duree in plages_du_jour(medecin_id, date_obj):
+        if plage_debut <= debut < plage_fin:
+            return duree or DUREE_PAR_DEFAUT
+    return DUREE_PAR_DEFAUT
+
+
+def chevauchement(medecin_id, date_obj, debut, duree):
+    """Premier RDV confirmé qui chevauche [debut, debut + duree), ou None"""
+    return Appointment.query.filter(
+        Appointment.medecin_id == medecin_id,
+        Appointment.date == date_obj,
+        Appointment.statut == 'confirme',
+        # Plage bornée de l'index (medecin_id, date, debut)
+        Appointment.debut > debut - DUREE_MAX_RDV,
+        Appointment.debut < debut + duree,
+        Appointment.debut + Appointment.duree > debut
+    ).first()
+
+
+def preparer_reservation(medecin_id, date_obj, debut):
+    """
+    Verrouille l'agenda du médecin jusqu'au commit, puis vérifie le créneau
+    (jour ni d'absence ni de fermeture, aucun RDV confirmé qui chevauche)
+    Retourne la durée du RDV à créer, ou None si le créneau n'est plus libre
+    """
+    # Écriture factice sur la ligne du médecin, avant toute vérification :
+    # verrou de ligne sur PostgreSQL, verrou d'écriture de la base sur SQLite
+    # (où SELECT ... FOR UPDATE n'a aucun effet). Les réservations simultanées
+    # chez ce médecin attendent ici le commit de la précédente, et voient donc
+    # son RDV lors du contrôle de chevauchement.
+    db.session.execute(db.update(User).where(User.id == medecin_id).values(id=User.id))
+    # Absence du médecin ou fermeture de sa clinique ce jour-là
+    clinique_id = db.session.query(User.clinique_id).filter_by(id=medecin_id).scalar()
+    if jours_exclus({clinique_id}, {medecin_id}, date_obj, date_obj):
+        return None
+    duree = duree_en_vigueur(medecin_id, date_obj, debut)
+    if chevauchement(medecin_id, date_obj, debut, duree):
+        return None
+    return duree
+
+
+def _version_creneaux(medecin_id):
+    """Version du cache d'un médecin ; la changer rend toutes ses journées obsolètes"""
+    return cache.version(f"creneaux_version:{int(medecin_id)}")
+
+
+def cle_cache_creneaux(medecin_id, date_obj):
+    return f"creneaux:{int(medecin_id)}:{_version_creneaux(medecin_id)}:{date_obj.isoformat()}"
+
+
+def invalider_creneaux(medecin_id, date_obj):
+    """À appeler après toute modification des RDV ou disponibilités d'un médecin pour une date"""
+    cache.delete(cle_cache_creneaux(medecin_id, date_obj))
+
+
+def invalider_creneaux_medecin(medecin_id):
+    """À appeler après une modification touchant plusieurs jours (règles, exceptions)"""
+    cache.delete(f"creneaux_version:{int(medecin_id)}")
+
+
+def creneaux_disponibles(medecin_id, date_obj):
+    """Créneaux libres ("HH:MM") d'un médecin pour une date (mis en cache)"""
+    cle = cle_cache_creneaux(medecin_id, date_obj)
+    creneaux = cache.get(cle)
+    if creneaux is not None:
+        return creneaux
+
+    plages = plages_du_jour(medecin_id, date_obj)
+    if plages:
+        libres = generer_creneaux(plages, rdv_pris_du_jour(medecin_id, date_obj))
+        creneaux = [minutes_en_heure(m) for m in libres]
+    else:
+        creneaux = []
+
+    cache.set(cle, creneaux, ttl=current_app.config.get('CRENEAUX_CACHE_TTL'))
+    return creneaux
+
+
+def _libres_periode(medecin_ids, date_debut, date_fin, clinique_id=None):
+    """Créneaux libres en minutes, en requêtes groupées : {(medecin_id, date): [debut, ...]}"""
+    query = db.session.query(
+        Availability.medecin_id, Availability.clinique_id, Availability.date,
+        Availability.debut, Availability.fin, Availability.duree_rdv
+    ).filter(
+        Availability.medecin_id.in_(medecin_ids),
+        Availability.date >= date_debut,
+        Availability.date <= date_fin
+    )
+    if clinique_id is not None:
+        query = query.filter(Availability.clinique_id == clinique_id)
+    rows = query.all()
+    exclus = jours_exclus({row.clinique_id for row in rows}, {row.medecin_id for row in rows},
+                          date_debut, date_fin) if rows else set()
+
+    plages = defaultdict(list)
+    for medecin_id, dispo_clinique_id, jour, debut, fin, duree in rows:
+        if not est_exclu(exclus, medecin_id, dispo_clinique_id, jour):
+            plages[(medecin_id, jour)].append((debut, fin, duree))
+    recurrentes = plages_recurrentes(date_debut, date_fin, medecin_ids=medecin_ids, clinique_id=clinique_id)
+    for cle, plages_jour in recurrentes.items():
+        plages[cle].extend(plages_jour)
+    if not plages:
+        return {}
+
+    prises = defaultdict(list)
+    rdvs = db.session.query(Appointment.medecin_id, Appointment.date, Appointment.debut, Appointment.duree).filter(
+        Appointment.medecin_id.in_({medecin_id for medecin_id, _ in plages}),
+        Appointment.date >= date_debut,
+        Appointment.date <= date_fin,
+        Appointment.statut == 'confirme'
+    )
+    for medecin_id, jour, debut, duree in rdvs:
+        prises[(medecin_id, jour)].append((debut, duree))
+
+    return {
+        cle: generer_creneaux(plages_jour, prises.get(cle, ()))
+        for cle, plages_jour in plages.items()
+    }
+
+
+def creneaux_disponibles_periode(medecin_ids, date_debut, date_fin, clinique_id=None):
+    """
+    Créneaux libres de plusieurs médecins sur une période, en requêtes groupées
+    (disponibilités, règles, exceptions, rendez-vous)
+    Retourne {medecin_id: {"YYYY-MM-DD": ["HH:MM", ...]}} ; seuls les jours
+    ayant des disponibilités apparaissent
+    """
+    resultat = {medecin_id: {} for medecin_id in medecin_ids}
+    for (medecin_id, jour), libres in sorted(_libres_periode(medecin_ids, date_debut, date_fin, clinique_id).items()):
+        resultat[medecin_id][jour.isoformat()] = [minutes_en_heure(m) for m in libres]
+    return resultat
+
+
+def flux_creneaux_libres(medecin_ids, date_debut, date_fin, clinique_id=None, fenetre_jours=FENETRE_RECHERCHE_JOURS):
+    """
+    Générateur des créneaux libres de plusieurs médecins, dans l'ordre chronologique
+    Les données sont chargées par fenêtres de quelques jours (requêtes groupées) et
+    les créneaux des médecins sont fusionnés jour par jour : le consommateur
+    peut s'arrêter dès qu'il en a assez, sans charger le reste de la période.
+    Produit des tuples (date, debut, medecin_id)
+    """
+    jour = date_debut
+    while jour <= date_fin:
+        fin_fenetre = min(jour + timedelta(days=fenetre_jours - 1), date_fin)
+        par_jour = defaultdict(list)
+        for (medecin_id, jour_libre), libres in _libres_periode(medecin_ids, jour, fin_fenetre, clinique_id).items():
+            par_jour[jour_libre].append([(debut, medecin_id) for debut in libres])
+        for jour_libre in sorted(par_jour):
+            for debut, medecin_id in heapq.merge(*par_jour[jour_libre]):
+                yield jour_libre, debut, medecin_id
+        jour = fin_fenetre + timedelta(days=1)
+
+
+def prochains_creneaux(medecin_ids, n, a_partir_de, clinique_id=None, horizon_jours=PERIODE_MAX_JOURS):
+    """
+    Les n premiers créneaux libres, tous médecins confondus, à partir d'un datetime
+    Retourne une liste de (date, debut, medecin_id)
+    """
+    if not medecin_ids:
+        return []
+    aujourdhui = a_partir_de.date()
+    maintenant = a_partir_de.hour * 60 + a_partir_de.minute
+    flux = flux_creneaux_libres(medecin_ids, aujourdhui, aujourdhui + timedelta(days=horizon_jours - 1), clinique_id)
+    a_venir = (creneau for creneau in flux if creneau[0] > aujourdhui or creneau[1] > maintenant)
+    return list(islice(a_venir, n))
+
+
+if __name__ == '__main__':
+    # Micro-benchmark : journée de 12h à 5 minutes, un créneau sur trois pris
+    import timeit
+    plages = [(8 * 60, 20 * 60, 5)]
+    prises = [(debut, 5) for debut in range(8 * 60, 20 * 60, 15)]
+    n = 10000
+    t = timeit.timeit(lambda: [minutes_en_heure(m) for m in generer_creneaux(plages, prises)], number=n)
+    print(f"generer_creneaux : {t / n * 1e6:.1f} µs par appel ({len(generer_creneaux(plages, prises))} créneaux libres)")
@@ -0,0 +1,186 @@
+import json
+import queue
+import time
+from collections import defaultdict
+from threading import Lock, BoundedSemaphore
+
+# =======================================================
+# ÉVÉNEMENTS EN DIRECT (Server-Sent Events)
+# =======================================================
+# Les routes publient un événement après chaque écriture sur un RDV
+# (création, annulation, changement de statut) ; le dashboard et le
+# calendrier l'écoutent via /api/evenements et se mettent à jour sans
+# recharger. Backend choisi par init_app() :
+#   - REDIS_URL défini -> pub/sub Redis, partagé entre workers
+#   - sinon -> diffusion en mémoire, propre au processus
+# Un abonnement à clinique_id=None reçoit les événements de toutes les
+# cliniques (super_admin).
+#
+# Chaque flux ouvert occupe un thread du worker (gthread) pendant toute sa
+# durée. Leur nombre est donc limité par worker (SSE_FLUX_MAX, à garder
+# sous le nombre de threads) : au-delà, /api/evenements répond 503 et les
+# pages se mettent à jour en interrogeant périodiquement l'API à la place.
+
+# Secondes entre deux commentaires "ping" (garde la connexion ouverte derrière un proxy)
+INTERVALLE_PING = 15
+
+# Durée de vie d'un flux : le navigateur se reconnecte seul (EventSource),
+# ce qui libère régulièrement le thread du worker
+DUREE_MAX_FLUX = 300
+
+# Flux ouverts simultanément par worker, si SSE_FLUX_MAX n'est pas configuré
+FLUX_MAX_PAR_DEFAUT = 8
+
+
+class AbonnementMemoire:
+    def __init__(self, broker, clinique_id):
+        self.broker = broker
+        self.clinique_id = clinique_id
+        # File bornée : un client trop lent perd des messages au lieu de bloquer les routes
+        self.file = queue.Queue(maxsize=100)
+
+    def lire(self, timeout):
+        try:
+            return self.file.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def fermer(self):
+        self.broker._retirer(self)
+
+
+class BrokerMemoire:
+    """Diffusion aux abonnés du processus courant (un seul worker)"""
+
+    def __init__(self):
+        self._abonnes = defaultdict(set)
+        self._lock = Lock()
+
+    def publier(self, clinique_id, message):
+        with self._lock:
+            abonnes = list(self._abonnes.get(clinique_id, ())) + list(self._abonnes.get(None, ()))
+        for abonnement in abonnes:
+            try:
+                abonnement.file.put_nowait(message)
+            except queue.Full:
+                pass
+
+    def abonner(self, clinique_id):
+        abonnement = AbonnementMemoire(self, clinique_id)
+        with self._lock:
+            self._abonnes[clinique_id].add(abonnement)
+        return abonnement
+
+    def _retirer(self, abonnement):
+        with self._lock:
+            self._abonnes[abonnement.clinique_id].discard(abonnement)
+
+
+class AbonnementRedis:
+    def __init__(self, pubsub):
+        self.pubsub = pubsub
+
+    def lire(self, timeout):
+        message = self.pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+        if message is None:
+            return None
+        return message['data'].decode('utf-8')
+
+    def fermer(self):
+        self.pubsub.close()
+
+
+class BrokerRedis:
+    """Pub/sub Redis : un canal par clinique, partagé entre workers et serveurs"""
+
+    def __init__(self, url, prefixe='clinique-rdv:evenements:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.client.ping()
+        self.prefixe = prefixe
+
+    def publier(self, clinique_id, message):
+        self.client.publish(f"{self.prefixe}{clinique_id}", message)
+
+    def abonner(self, clinique_id):
+        pubsub = self.client.pubsub()
+        if clinique_id is None:
+            pubsub.psubscribe(f"{self.prefixe}*")
+        else:
+            pubsub.subscribe(f"{self.prefixe}{clinique_id}")
+        return AbonnementRedis(pubsub)
+
+
+class Evenements:
+    """Point d'accès unique à la diffusion d'événements, initialisé comme une extension Flask"""
+
+    def __init__(self):
+        self.backend = BrokerMemoire()
+        self.places = BoundedSemaphore(FLUX_MAX_PAR_DEFAUT)
+
+    def init_app(self, app):
+        self.places = BoundedSemaphore(app.config.get('SSE_FLUX_MAX', FLUX_MAX_PAR_DEFAUT))
+        url = app.config.get('REDIS_URL')
+        if url and url.startswith(('redis://', 'rediss://')):
+            try:
+                self.backend = BrokerRedis(url)
+                return
+            except Exception as e:
+                print(f"⚠️ Pub/sub Redis indisponible, événements limités au worker courant: {e}")
+        self.backend = BrokerMemoire()
+
+    def publier(self, clinique_id, type_evenement, donnees):
+        """À appeler après le commit ; une panne de diffusion ne fait jamais échouer la requête"""
+        message = json.dumps({'type': type_evenement, 'donnees': donnees})
+        try:
+            self.backend.publier(int(clinique_id), message)
+        except Exception as e:
+            print(f"⚠️ Erreur publication événement: {e}")
+
+    def reserver_flux(self):
+        """Réserve une place de flux dans le worker ; False si toutes sont prises"""
+        return self.places.acquire(blocking=False)
+
+    def liberer_flux(self):
+        """À appeler à la fermeture de la réponse (call_on_close)"""
+        self.places.release()
+
+    def flux(self, clinique_id):
+        """Générateur au format text/event-stream pour une clinique (None : toutes)"""
+        abonnement = self.backend.abonner(clinique_id)
+        try:
+            yield "retry: 3000\n\n"
+            fin = time.monotonic() + DUREE_MAX_FLUX
+            while time.monotonic() < fin:
+                message = abonnement.lire(timeout=INTERVALLE_PING)
+                if message is None:
+                    yield ": ping\n\n"
+                    continue
+                type_evenement = json.loads(message)['type']
+                yield f"event: {type_evenement}\ndata: {message}\n\n"
+        finally:
+            abonnement.fermer()
+
+
+def rdv_en_dict(rdv):
+    """RDV au format de /api/rendez-vous (+ medecin_id), pour patcher le calendrier"""
+    return {
+        'id': rdv.id,
+        'medecin_id': rdv.medecin_id,
+        'patient_nom': rdv.patient.nom,
+        'patient_tel': rdv.patient.telephone,
+        'medecin_nom': rdv.doctor.nom,
+        'date': rdv.date.isoformat(),
+        'heure': rdv.heure,
+        'fin': rdv.heure_fin,
+        'statut': rdv.statut,
+        'motif': rdv.motif
+    }
+
+
+def publier_rdv(type_evenement, rdv):
+    """Publie un événement (rdv_cree, rdv_annule, rdv_statut) pour la clinique du RDV"""
+    evenements.publier(rdv.clinique_id, type_evenement, rdv_en_dict(rdv))
+
+
+evenements = Evenements()
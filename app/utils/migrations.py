@@ -0,0 +1,279 @@
+from sqlalchemy import text, inspect
+from sqlalchemy.exc import IntegrityError, DBAPIError
+from datetime import datetime
+from models import db
+from app.utils.patients import DOCUMENT_RECHERCHE_PG
+from app.utils.sms_utils import telephone_e164
+
+# =======================================================
+# MIGRATIONS DU SCHÉMA
+# =======================================================
+# db.create_all() crée les tables manquantes mais ne modifie jamais une
+# table existante : chaque évolution du schéma d'une base déjà en
+# production passe donc par une migration numérotée ci-dessous.
+# Une base neuve reçoit directement le schéma final de db.create_all() :
+# ses migrations sont alors marquées comme appliquées sans être exécutées.
+# Elles restent idempotentes (IF NOT EXISTS...) par prudence.
+# Exception : les objets que les modèles ne décrivent pas (table FTS5,
+# triggers, fonctions SQL) ne sont pas créés par db.create_all() ; leurs
+# migrations, listées dans MIGRATIONS_HORS_MODELES, s'exécutent aussi sur
+# une base neuve.
+
+
+class MigrationReportee(Exception):
+    """Levée par une migration qui ne peut pas encore s'appliquer (données à corriger)"""
+
+
+def creer_index(conn, nom, table, colonnes, unique=False, where=None):
+    """Crée un index s'il n'existe pas (SQLite et PostgreSQL)"""
+    sql = f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {nom} ON {table} ({', '.join(colonnes)})"
+    if where:
+        sql += f" WHERE {where}"
+    conn.execute(text(sql))
+
+
+def migration_001_index_recherche(conn):
+    """Index composites pour les créneaux, la réservation et le dashboard"""
+    creer_index(conn, 'ix_appointments_medecin_date_statut', 'appointments', ['medecin_id', 'date', 'statut'])
+    creer_index(conn, 'ix_appointments_clinique_date', 'appointments', ['clinique_id', 'date'])
+    creer_index(conn, 'ix_availability_medecin_date', 'availability', ['medecin_id', 'date'])
+    creer_index(conn, 'ix_patients_clinique_nom', 'patients', ['clinique_id', 'nom'])
+    creer_index(conn, 'ix_patients_telephone', 'patients', ['telephone'])
+
+
+def migration_002_unicite_creneau(conn):
+    """Index unique partiel : un seul RDV confirmé par (médecin, date, heure)"""
+    doublons = conn.execute(text(
+        "SELECT medecin_id, date, heure, COUNT(*) FROM appointments "
+        "WHERE statut = 'confirme' GROUP BY medecin_id, date, heure HAVING COUNT(*) > 1"
+    )).fetchall()
+    if doublons:
+        # On ne choisit pas à la place de la clinique quel RDV annuler
+        details = ', '.join(f"médecin {m} le {d} à {h} ({n} RDV)" for m, d, h, n in doublons[:10])
+        raise MigrationReportee(f"{len(doublons)} créneau(x) réservé(s) plusieurs fois : {details}")
+    creer_index(conn, 'uq_appointments_creneau_confirme', 'appointments',
+                ['medecin_id', 'date', 'heure'], unique=True, where="statut = 'confirme'")
+
+
+def colonnes(conn, table):
+    return {colonne['name'] for colonne in inspect(conn).get_columns(table)}
+
+
+def _convertir_heure_en_minutes(conn, table, ancienne, nouvelle):
+    """Remplace une colonne "HH:MM" par une colonne entière (minutes depuis minuit)"""
+    if ancienne not in colonnes(conn, table):
+        return
+    position = "STRPOS" if conn.dialect.name == 'postgresql' else "INSTR"
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {nouvelle} INTEGER"))
+    conn.execute(text(
+        f"UPDATE {table} SET {nouvelle} = "
+        f"CAST(SUBSTR({ancienne}, 1, {position}({ancienne}, ':') - 1) AS INTEGER) * 60 + "
+        f"CAST(SUBSTR({ancienne}, {position}({ancienne}, ':') + 1, 2) AS INTEGER)"
+    ))
+    conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {ancienne}"))
+    if conn.dialect.name == 'postgresql':
+        # SQLite ne sait pas ajouter NOT NULL a posteriori ; le modèle l'impose
+        conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN {nouvelle} SET NOT NULL"))
+
+
+def migration_003_heures_en_minutes(conn):
+    """Heures stockées en minutes depuis minuit au lieu de String(5)"""
+    # L'index d'unicité porte sur l'ancienne colonne : le recréer sur la nouvelle
+    conn.execute(text("DROP INDEX IF EXISTS uq_appointments_creneau_confirme"))
+    _convertir_heure_en_minutes(conn, 'appointments', 'heure', 'debut')
+    creer_index(conn, 'uq_appointments_creneau_confirme', 'appointments',
+                ['medecin_id', 'date', 'debut'], unique=True, where="statut = 'confirme'")
+    
+    for table in ('availability', 'availability_rules'):
+        _convertir_heure_en_minutes(conn, table, 'heure_debut', 'debut')
+        _convertir_heure_en_minutes(conn, table, 'heure_fin', 'fin')
+
+
+def migration_004_duree_rdv(conn):
+    """Durée de chaque RDV, reprise de la disponibilité du jour (30 min à défaut)"""
+    if 'duree' not in colonnes(conn, 'appointments'):
+        conn.execute(text("ALTER TABLE appointments ADD COLUMN duree INTEGER DEFAULT 30"))
+        conn.execute(text(
+            "UPDATE appointments SET duree = COALESCE(("
+            "SELECT a.duree_rdv FROM availability a "
+            "WHERE a.medecin_id = appointments.medecin_id AND a.date = appointments.date "
+            "AND appointments.debut >= a.debut AND appointments.debut < a.fin "
+            "LIMIT 1), 30)"
+        ))
+        if conn.dialect.name == 'postgresql':
+            conn.execute(text("ALTER TABLE appointments ALTER COLUMN duree SET NOT NULL"))
+    creer_index(conn, 'ix_appointments_medecin_date_debut', 'appointments', ['medecin_id', 'date', 'debut'])
+
+
+def migration_005_daily_stats(conn):
+    """Remplit daily_stats (créée par db.create_all()) à partir des RDV existants"""
+    if conn.execute(text("SELECT COUNT(*) FROM daily_stats")).scalar():
+        return
+    conn.execute(text(
+        "INSERT INTO daily_stats (clinique_id, medecin_id, date, statut, nombre) "
+        "SELECT clinique_id, medecin_id, date, COALESCE(statut, 'confirme'), COUNT(*) FROM appointments "
+        "GROUP BY clinique_id, medecin_id, date, COALESCE(statut, 'confirme')"
+    ))
+
+
+def migration_006_index_tri_patients(conn):
+    """Index de tri de la liste des patients par date de création (pagination par curseur)"""
+    creer_index(conn, 'ix_patients_clinique_date_creation', 'patients', ['clinique_id', 'date_creation'])
+
+
+def _recherche_fts5(conn):
+    conn.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS patients_fts USING fts5("
+        "nom, telephone, email, content='patients', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    ))
+    # Table à contenu externe : les triggers y reportent chaque écriture sur patients
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS patients_fts_ai AFTER INSERT ON patients BEGIN "
+        "INSERT INTO patients_fts (rowid, nom, telephone, email) VALUES (new.id, new.nom, new.telephone, new.email); "
+        "END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS patients_fts_ad AFTER DELETE ON patients BEGIN "
+        "INSERT INTO patients_fts (patients_fts, rowid, nom, telephone, email) "
+        "VALUES ('delete', old.id, old.nom, old.telephone, old.email); "
+        "END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS patients_fts_au AFTER UPDATE OF nom, telephone, email ON patients BEGIN "
+        "INSERT INTO patients_fts (patients_fts, rowid, nom, telephone, email) "
+        "VALUES ('delete', old.id, old.nom, old.telephone, old.email); "
+        "INSERT INTO patients_fts (rowid, nom, telephone, email) VALUES (new.id, new.nom, new.telephone, new.email); "
+        "END"
+    ))
+    conn.execute(text("INSERT INTO patients_fts (patients_fts) VALUES ('rebuild')"))
+
+
+def _recherche_trigrammes(conn):
+    try:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS unaccent"))
+    except DBAPIError as e:
+        raise MigrationReportee(f"extensions pg_trgm / unaccent à installer par un superutilisateur ({e.orig})")
+    # unaccent() n'est pas IMMUTABLE : une fonction enveloppe l'est, pour pouvoir l'indexer
+    conn.execute(text(
+        "CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text "
+        "LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT AS "
+        "$$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$"
+    ))
+    conn.execute(text(
+        f"CREATE INDEX IF NOT EXISTS ix_patients_recherche_trgm ON patients "
+        f"USING gin (({DOCUMENT_RECHERCHE_PG}) gin_trgm_ops)"
+    ))
+
+
+def migration_007_recherche_patients(conn):
+    """Index de recherche des patients : FTS5 (SQLite) ou trigrammes (PostgreSQL)"""
+    if conn.dialect.name == 'sqlite':
+        _recherche_fts5(conn)
+    elif conn.dialect.name == 'postgresql':
+        _recherche_trigrammes(conn)
+
+
+# Nombre de patients normalisés par lot (migration 008)
+TAILLE_LOT_TELEPHONES = 1000
+
+
+def migration_008_telephone_normalise(conn):
+    """Ajoute patients.telephone_norm (E.164) et le remplit par lots"""
+    if 'telephone_norm' not in colonnes(conn, 'patients'):
+        conn.execute(text("ALTER TABLE patients ADD COLUMN telephone_norm VARCHAR(20)"))
+
+    # La normalisation est faite en Python (telephone_e164, la même qu'à
+    # l'écriture) : lots parcourus par id croissant, mémoire bornée
+    dernier_id = 0
+    while True:
+        lot = conn.execute(text(
+            "SELECT id, telephone FROM patients WHERE id > :dernier_id AND telephone_norm IS NULL "
+            "ORDER BY id LIMIT :taille"
+        ), {'dernier_id': dernier_id, 'taille': TAILLE_LOT_TELEPHONES}).fetchall()
+        if not lot:
+            break
+        conn.execute(
+            text("UPDATE patients SET telephone_norm = :telephone_norm WHERE id = :id"),
+            [{'id': patient_id, 'telephone_norm': telephone_e164(telephone)} for patient_id, telephone in lot]
+        )
+        dernier_id = lot[-1][0]
+
+
+def migration_009_unicite_telephone(conn):
+    """Index unique : un seul patient par numéro normalisé dans une clinique"""
+    doublons = conn.execute(text(
+        "SELECT clinique_id, telephone_norm, COUNT(*) FROM patients "
+        "WHERE telephone_norm IS NOT NULL GROUP BY clinique_id, telephone_norm HAVING COUNT(*) > 1"
+    )).fetchall()
+    if doublons:
+        # Fusionner des dossiers patients (RDV, ordonnances) reste une décision de la clinique
+        details = ', '.join(f"clinique {c} : {t} ({n} patients)" for c, t, n in doublons[:10])
+        raise MigrationReportee(f"{len(doublons)} numéro(s) partagé(s) par plusieurs patients : {details}")
+    creer_index(conn, 'uq_patients_clinique_telephone_norm', 'patients', ['clinique_id', 'telephone_norm'], unique=True)
+
+
+# Liste ordonnée : (version, description, fonction)
+MIGRATIONS = [
+    ('001', 'Index composites rendez-vous / disponibilités / patients', migration_001_index_recherche),
+    ('002', 'Unicité des créneaux confirmés', migration_002_unicite_creneau),
+    ('003', 'Heures en minutes depuis minuit', migration_003_heures_en_minutes),
+    ('004', 'Durée des rendez-vous', migration_004_duree_rdv),
+    ('005', 'Statistiques journalières (daily_stats)', migration_005_daily_stats),
+    ('006', 'Index de tri des patients par date de création', migration_006_index_tri_patients),
+    ('007', 'Recherche plein texte des patients', migration_007_recherche_patients),
+    ('008', 'Téléphone normalisé des patients (E.164)', migration_008_telephone_normalise),
+    ('009', 'Unicité du téléphone par clinique', migration_009_unicite_telephone),
+]
+
+# Migrations exécutées même sur une base neuve (objets hors modèles)
+MIGRATIONS_HORS_MODELES = {'007'}
+
+
+def est_base_neuve():
+    """Vrai si la base n'a encore aucune table (à appeler avant db.create_all())"""
+    return not inspect(db.engine).has_table('appointments')
+
+
+def appliquer_migrations(base_neuve=False):
+    """
+    Applique les migrations en attente (à appeler dans un app_context).
+    Retourne l'ensemble des versions appliquées, y compris les précédentes.
+    """
+    with db.engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version VARCHAR(20) PRIMARY KEY, "
+            "description VARCHAR(200), "
+            "date_application TIMESTAMP)"
+        ))
+        appliquees = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+    for version, description, migration in MIGRATIONS:
+        if version in appliquees:
+            continue
+        try:
+            # Une transaction par migration : tout ou rien
+            with db.engine.begin() as conn:
+                if not base_neuve or version in MIGRATIONS_HORS_MODELES:
+                    migration(conn)
+                conn.execute(
+                    text("INSERT INTO schema_migrations (version, description, date_application) "
+                         "VALUES (:version, :description, :date)"),
+                    {'version': version, 'description': description, 'date': datetime.utcnow()}
+                )
+            if not base_neuve:
+                print(f"🛠️ Migration {version} appliquée : {description}")
+        except IntegrityError:
+            # Un autre worker gunicorn l'a appliquée en même temps
+            pass
+        except MigrationReportee as e:
+            # Non enregistrée : réessayée au prochain démarrage. Les migrations
+            # suivantes ne dépendent pas d'elle (007 et 009 sont des feuilles)
+            # et s'appliquent quand même.
+            print(f"⚠️ Migration {version} reportée : {e}")
+            continue
+        appliquees.add(version)
+
+    return appliquees
@@ -0,0 +1,202 @@
+import base64
+import json
+import re
+import unicodedata
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import text, func, literal_column
+from sqlalchemy.exc import IntegrityError
+from models import db, Patient
+from app.utils.sms_utils import telephone_e164
+
+# =======================================================
+# LISTE DES PATIENTS : PAGINATION PAR CURSEUR
+# =======================================================
+# Pagination "keyset" : au lieu de OFFSET (qui relit toutes les lignes des
+# pages précédentes), chaque page reprend après le dernier patient de la
+# page précédente, repéré par (valeur de la colonne de tri, id). Le coût
+# d'une page ne dépend donc pas de sa profondeur.
+# Le curseur renvoyé au client est opaque (JSON encodé en base64) : il
+# contient aussi le tri, pour refuser un curseur réutilisé avec un autre tri.
+
+# Colonnes de tri autorisées (toutes indexées avec clinique_id) ; "pertinence"
+# n'a de sens qu'avec une recherche (rang calculé par rechercher_patients)
+TRIS_PATIENTS = {
+    'nom': Patient.nom,
+    'date_creation': Patient.date_creation,
+    'id': Patient.id,
+    'pertinence': None,
+}
+
+PAR_PAGE_MAX = 100
+
+
+class CurseurInvalide(ValueError):
+    """Curseur illisible ou produit pour un autre tri"""
+
+
+def _valeur_json(valeur):
+    return valeur.isoformat() if isinstance(valeur, datetime) else valeur
+
+
+def encoder_curseur(tri, sens, valeur, patient_id):
+    donnees = [tri, sens, _valeur_json(valeur), patient_id]
+    return base64.urlsafe_b64encode(json.dumps(donnees).encode('utf-8')).decode('ascii')
+
+
+def decoder_curseur(curseur, tri, sens):
+    """Retourne (valeur, id) de la dernière ligne de la page précédente"""
+    try:
+        tri_curseur, sens_curseur, valeur, dernier_id = json.loads(base64.urlsafe_b64decode(curseur.encode('ascii')))
+        if tri == 'date_creation':
+            valeur = datetime.fromisoformat(valeur)
+        elif tri == 'pertinence':
+            valeur = float(valeur)
+        dernier_id = int(dernier_id)
+    except (ValueError, TypeError, UnicodeError):
+        raise CurseurInvalide('Curseur invalide')
+    if (tri_curseur, sens_curseur) != (tri, sens):
+        raise CurseurInvalide('Curseur produit pour un autre tri')
+    return valeur, dernier_id
+
+
+def page_patients(query, tri, sens, curseur, par_page, rang=None):
+    """
+    Une page de patients triée par (tri, id) dans le sens donné, reprenant
+    après le curseur. rang : expression de pertinence (tri='pertinence').
+    Retourne (patients, next_cursor) ; next_cursor vaut None sur la
+    dernière page.
+    """
+    colonne = rang if tri == 'pertinence' else TRIS_PATIENTS[tri]
+    colonnes = [Patient.id] if tri == 'id' else [colonne, Patient.id]
+
+    if curseur:
+        valeur, dernier_id = decoder_curseur(curseur, tri, sens)
+        if tri == 'id':
+            cle, apres = Patient.id, dernier_id
+        else:
+            cle, apres = db.tuple_(*colonnes), db.tuple_(valeur, dernier_id)
+        query = query.filter(cle > apres if sens == 'asc' else cle < apres)
+
+    query = query.add_columns(colonne).order_by(*(colonnes if sens == 'asc' else [c.desc() for c in colonnes]))
+
+    # Une ligne de plus pour savoir s'il reste une page
+    lignes = query.limit(par_page + 1).all()
+    suivant = None
+    if len(lignes) > par_page:
+        lignes = lignes[:par_page]
+        dernier, valeur = lignes[-1]
+        suivant = encoder_curseur(tri, sens, valeur, dernier.id)
+    return [patient for patient, _ in lignes], suivant
+
+
+# =======================================================
+# IDENTITÉ : UN PATIENT PAR NUMÉRO ET PAR CLINIQUE
+# =======================================================
+def patient_par_telephone(clinique_id, telephone):
+    """Patient de la clinique ayant ce numéro, quel que soit son format (77 123 45 67, +221...)"""
+    telephone_norm = telephone_e164(telephone)
+    if telephone_norm is None:
+        return None
+    return Patient.query.filter_by(clinique_id=clinique_id, telephone_norm=telephone_norm).first()
+
+
+def obtenir_ou_creer_patient(clinique_id, nom, telephone, email=None):
+    """
+    Patient de la clinique ayant ce numéro, créé s'il n'existe pas.
+    Retourne (patient, cree) ; le commit reste à l'appelant, le patient créé
+    est donc annulé avec le reste de la transaction (RDV refusé...).
+    À appeler en début de transaction : si une réservation simultanée a créé
+    le même patient entre-temps (index unique clinique + numéro), la
+    transaction est annulée et le patient existant est renvoyé.
+    """
+    patient = patient_par_telephone(clinique_id, telephone)
+    if patient:
+        return patient, False
+
+    # Pas de point de sauvegarde : pysqlite valide la transaction au RELEASE
+    # d'un SAVEPOINT ouvert hors transaction
+    patient = Patient(nom=nom, telephone=telephone, email=email or None, clinique_id=clinique_id)
+    db.session.add(patient)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        return patient_par_telephone(clinique_id, telephone), False
+    return patient, True
+
+
+# =======================================================
+# RECHERCHE DE PATIENTS (index plein texte)
+# =======================================================
+# Une seule fonction de recherche, servie par un index selon la base :
+#   - SQLite : table FTS5 patients_fts (contenu externe = patients),
+#     tenue à jour par des triggers, tokenizer unicode61 sans accents
+#   - PostgreSQL : index GIN pg_trgm sur le document sans accents
+#   - autre : ILIKE '%terme%' (parcours complet, sans index)
+# Chaque mot saisi doit apparaître (ET) ; sur SQLite il est cherché comme
+# préfixe d'un mot ("dio" trouve "Diop"), sur PostgreSQL comme sous-chaîne.
+# Les accents et la casse sont ignorés ("ndeye" trouve "Ndèye").
+
+# Document indexé sur PostgreSQL : l'expression doit rester identique à
+# celle de l'index ix_patients_recherche_trgm pour qu'il soit utilisé
+DOCUMENT_RECHERCHE_PG = (
+    "f_unaccent(lower(patients.nom || ' ' || patients.telephone || ' ' || coalesce(patients.email, '')))"
+)
+
+# Poids bm25 des colonnes de patients_fts (nom, telephone, email)
+POIDS_FTS = (10.0, 5.0, 1.0)
+
+
+def _mots(terme):
+    return re.findall(r'[^\W_]+', terme)
+
+
+def _sans_accents(mot):
+    decompose = unicodedata.normalize('NFKD', mot.lower())
+    return ''.join(c for c in decompose if not unicodedata.combining(c))
+
+
+def rechercher_patients(query, terme):
+    """
+    Filtre query (sur Patient) sur les patients correspondant à terme.
+    Retourne (query, rang) : rang est une expression de pertinence, les
+    meilleurs résultats ayant le rang le plus petit.
+    """
+    mots = _mots(terme)
+    if not mots:
+        return query.filter(db.false()), db.literal(0.0)
+
+    # Sans la migration 007 (reportée, ex. pg_trgm indisponible), ni la
+    # table FTS5 ni f_unaccent n'existent : simple ILIKE
+    dialecte = db.engine.dialect.name
+    if '007' not in current_app.extensions.get('migrations_appliquees', ()):
+        dialecte = None
+
+    if dialecte == 'sqlite':
+        expression = ' '.join(f'"{mot}"*' for mot in mots)
+        poids = ', '.join(str(p) for p in POIDS_FTS)
+        recherche = text(
+            f"SELECT rowid AS patient_id, bm25(patients_fts, {poids}) AS rang "
+            f"FROM patients_fts WHERE patients_fts MATCH :expression"
+        ).bindparams(expression=expression).columns(
+            patient_id=db.Integer, rang=db.Float
+        ).subquery('recherche')
+        # "+ 0" : interdit à SQLite d'interroger l'index FTS une fois par patient
+        # de la clinique (rowid = ?) ; la recherche est faite une fois, puis
+        # chaque résultat est retrouvé par sa clé primaire
+        query = query.join(recherche, recherche.c.patient_id + 0 == Patient.id)
+        return query, recherche.c.rang
+
+    if dialecte == 'postgresql':
+        document = literal_column(DOCUMENT_RECHERCHE_PG)
+        mots = [_sans_accents(mot) for mot in mots]
+        for mot in mots:
+            query = query.filter(document.like(f'%{mot}%'))
+        return query, -func.word_similarity(' '.join(mots), document)
+
+    query = query.filter(db.and_(*(
+        db.or_(Patient.nom.ilike(f'%{mot}%'), Patient.telephone.ilike(f'%{mot}%'), Patient.email.ilike(f'%{mot}%'))
+        for mot in mots
+    )))
+    return query, db.literal(0.0)
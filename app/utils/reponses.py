@@ -0,0 +1,178 @@
+import gzip
+import hashlib
+from functools import wraps
+from flask import current_app, request, make_response
+from flask.json.provider import DefaultJSONProvider
+from flask_login import current_user
+from app.utils.cache import cache
+
+# Dépendances facultatives : sérialisation JSON rapide et compression brotli
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# =======================================================
+# RÉPONSES CONDITIONNELLES DU CALENDRIER (ETag)
+# =======================================================
+# FullCalendar recharge /api/rendez-vous et /api/disponibilites à chaque
+# changement de vue et à chaque refetchEvents(), le plus souvent pour un
+# contenu inchangé. Chaque clinique a une version du calendrier (clé de
+# cache, partagée entre workers avec Redis), changée par toute écriture
+# sur ses RDV ou disponibilités (invalider_calendrier). L'ETag est dérivé
+# de cette version et de l'URL : si le navigateur présente le même
+# (If-None-Match), la réponse est un 304, sans aucune requête en base.
+# clinique_id=None : vue globale (super_admin), changée par toute écriture.
+# Avec le cache mémoire, chaque worker a ses propres versions : une écriture
+# traitée par un autre worker n'y est pas vue. La version expire donc après
+# CALENDRIER_ETAG_TTL secondes, ce qui borne la durée d'un calendrier périmé
+# (comme CRENEAUX_CACHE_TTL pour les créneaux).
+
+
+def _cle_version(clinique_id):
+    return f"calendrier_version:{'global' if clinique_id is None else int(clinique_id)}"
+
+
+def invalider_calendrier(clinique_id=None):
+    """À appeler après le commit de toute écriture sur les RDV ou disponibilités d'une clinique"""
+    cles = [_cle_version(None)]
+    if clinique_id is not None:
+        cles.append(_cle_version(clinique_id))
+    cache.delete(*cles)
+
+
+def etag_calendrier(clinique_id):
+    """ETag de la requête courante pour la version actuelle du calendrier de la clinique"""
+    cle = _cle_version(clinique_id)
+    version = cache.version(cle, ttl=current_app.config.get('CALENDRIER_ETAG_TTL'))
+    empreinte = f"{cle}:{version}:{request.full_path}"
+    return hashlib.sha1(empreinte.encode('utf-8')).hexdigest()
+
+
+def calendrier_conditionnel(f):
+    """
+    Décorateur des API du calendrier : 304 si le navigateur a déjà la
+    version courante, sinon la réponse de la vue avec son ETag
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        clinique_id = None if current_user.role == 'super_admin' else current_user.clinique_id
+        etag = etag_calendrier(clinique_id)
+
+        # ETag faible : le même contenu compressé (gzip, br) ou non reste valide
+        if request.if_none_match.contains_weak(etag):
+            response = make_response('', 304)
+        else:
+            response = make_response(f(*args, **kwargs))
+        response.set_etag(etag, weak=True)
+        # Réponse propre à l'utilisateur, toujours revalidée auprès du serveur
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return decorated_function
+
+
+# =======================================================
+# SÉRIALISATION JSON RAPIDE (orjson)
+# =======================================================
+class JSONProviderOrjson(DefaultJSONProvider):
+    """
+    jsonify() et les réponses dict/list sérialisés par orjson, avec le même
+    résultat que le fournisseur par défaut (clés triées, dates au format
+    HTTP, Decimal, UUID...) ; les appels avec options particulières
+    (indent...) et les types refusés par orjson passent par le module json
+    """
+
+    def _options(self):
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        return options
+
+    def dumps(self, obj, **kwargs):
+        if not kwargs:
+            try:
+                return orjson.dumps(obj, default=self.default, option=self._options()).decode('utf-8')
+            except TypeError:
+                pass
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Sortie indentée en debug : fournisseur par défaut
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        try:
+            donnees = orjson.dumps(obj, default=self.default, option=self._options() | orjson.OPT_APPEND_NEWLINE)
+        except TypeError:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(donnees, mimetype=self.mimetype)
+
+
+# =======================================================
+# COMPRESSION DES RÉPONSES (gzip / brotli)
+# =======================================================
+# Négociée sur Accept-Encoding : brotli si le client l'accepte et que le
+# paquet est installé, sinon gzip. Seules les réponses 200 des API (JSON)
+# et des exports CSV sont compressées ; pas les petites réponses (sous
+# COMPRESSION_SEUIL octets), les flux (SSE) ni les fichiers envoyés par
+# send_file. Les pages HTML ne le sont jamais : elles contiennent le jeton
+# CSRF à côté de saisies réfléchies, ce que la compression exposerait (BREACH).
+
+TYPES_COMPRESSIBLES = {'application/json', 'text/csv'}
+
+
+class Reponses:
+    """JSON rapide et compression des réponses, initialisé comme une extension Flask"""
+
+    def init_app(self, app):
+        self.seuil = app.config.get('COMPRESSION_SEUIL', 1024)
+        self.niveau_gzip = app.config.get('COMPRESSION_NIVEAU_GZIP', 6)
+        self.niveau_brotli = app.config.get('COMPRESSION_NIVEAU_BROTLI', 4)
+        if app.config.get('JSON_RAPIDE', True) and orjson is not None:
+            app.json = JSONProviderOrjson(app)
+        if app.config.get('COMPRESSION', True):
+            app.after_request(self._compresser)
+
+    def _encodage(self):
+        """Meilleur encodage accepté par le client parmi ceux disponibles, ou None"""
+        acceptes = request.accept_encodings
+        candidats = [('br', acceptes['br'])] if brotli is not None else []
+        candidats.append(('gzip', acceptes['gzip']))
+        encodage, qualite = max(candidats, key=lambda candidat: candidat[1])
+        return encodage if qualite > 0 else None
+
+    def _compresser(self, response):
+        if (response.status_code != 200
+                or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in TYPES_COMPRESSIBLES):
+            return response
+
+        donnees = response.get_data()
+        if len(donnees) < self.seuil:
+            return response
+
+        # La réponse dépend d'Accept-Encoding, même quand elle n'est pas compressée
+        response.vary.add('Accept-Encoding')
+        encodage = self._encodage()
+        if encodage == 'br':
+            response.set_data(brotli.compress(donnees, quality=self.niveau_brotli))
+        elif encodage == 'gzip':
+            response.set_data(gzip.compress(donnees, compresslevel=self.niveau_gzip))
+        else:
+            return response
+        response.headers['Content-Encoding'] = encodage
+        return response
+
+
+reponses = Reponses()
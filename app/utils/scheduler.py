@@ -1,8 +1,9 @@
 from apscheduler.schedulers.background import BackgroundScheduler
 from flask import current_app
-from models import Appointment, Patient, User
+from models import db, Appointment, Patient, User
 from datetime import datetime, timedelta
 from app.utils.sms_utils import envoyer_sms_rappel_rdv, formater_numero_senegal
+from app.utils.statistiques import reconcilier_daily_stats
 
 scheduler = BackgroundScheduler()
 
@@ -37,6 +38,16 @@ def check_rdv_demain():
                 except Exception as e:
                     print(f"❌ Erreur rappel SMS pour {patient.nom}: {e}")
 
+def reconcilier_statistiques(app):
+    """Répare chaque nuit les écarts entre daily_stats et les rendez-vous"""
+    with app.app_context():
+        try:
+            corrections = reconcilier_daily_stats()
+            print(f"📊 Réconciliation des statistiques: {corrections} ligne(s) corrigée(s)")
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Erreur réconciliation des statistiques: {e}")
+
 def init_scheduler(app):
     """Initialise le planificateur avec l'application Flask"""
     scheduler.add_job(
@@ -46,5 +57,13 @@ def init_scheduler(app):
         hour=8,  # Tous les jours à 8h du matin
         minute=0
     )
+    scheduler.add_job(
+        id='reconciliation_statistiques',
+        func=reconcilier_statistiques,
+        args=[app],
+        trigger='cron',
+        hour=2,  # Toutes les nuits à 2h30
+        minute=30
+    )
     scheduler.start()
     print("⏰ Planificateur de rappels démarré (8h tous les jours)")
\ No newline at end of file
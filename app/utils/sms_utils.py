@@ -1,6 +1,7 @@
 import requests
 from flask import current_app
 import json
+import re
 
 def envoyer_sms(numero, message):
     """
@@ -74,15 +75,27 @@ def formater_numero_senegal(telephone):
     """
     Convertit un numéro sénégalais (77 123 45 67) au format international 221771234567
     """
-    # Enlever tous les espaces et tirets
-    nettoye = telephone.replace(' ', '').replace('-', '').replace('.', '')
+    # Garder uniquement les chiffres (espaces, tirets, points, "+"...)
+    nettoye = re.sub(r'\D', '', telephone or '')
     
-    # Si le numéro commence par 0, on enlève le 0
-    if nettoye.startswith('0'):
+    # Préfixe international 00, ou 0 national : on l'enlève
+    if nettoye.startswith('00'):
+        nettoye = nettoye[2:]
+    elif nettoye.startswith('0'):
         nettoye = nettoye[1:]
     
-    # Si le numéro n'a pas l'indicatif 221, on l'ajoute
-    if not nettoye.startswith('221'):
+    # Si le numéro local n'a pas l'indicatif 221, on l'ajoute
+    if not nettoye.startswith('221') and len(nettoye) <= 9:
         nettoye = '221' + nettoye
     
-    return nettoye
\ No newline at end of file
+    return nettoye
+
+def telephone_e164(telephone):
+    """
+    Numéro au format E.164 (+221771234567), clé d'identité des patients :
+    "77 123 45 67", "771234567" et "+221771234567" sont le même numéro.
+    None si le numéro ne contient aucun chiffre.
+    """
+    if not re.search(r'\d', telephone or ''):
+        return None
+    return '+' + formater_numero_senegal(telephone)
@@ -0,0 +1,265 @@
+from flask import current_app
+from sqlalchemy import func, case
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import db, User, Patient, Appointment, Clinique, DailyStat
+from app.utils.cache import cache
+
+# =======================================================
+# STATISTIQUES (compteurs agrégés)
+# =======================================================
+# Chaque compteur est une agrégation conditionnelle (SUM(CASE WHEN ...))
+# calculée dans une seule requête, au lieu d'un COUNT() par compteur.
+# clinique_id=None : toutes les cliniques (super_admin).
+#
+# Les compteurs de RDV sont lus dans daily_stats (un nombre par clinique,
+# médecin, jour et statut) : leur coût dépend du nombre de jours, pas du
+# nombre de rendez-vous. La table est tenue à jour dans la transaction de
+# chaque écriture (ajouter_rdv_stats, changer_statut_rdv) et réconciliée
+# chaque nuit (reconcilier_daily_stats) pour réparer toute dérive.
+#
+# Le dashboard et la page Statistiques sont mis en cache par clinique (et
+# une clé globale pour super_admin), avec un TTL court ; toute écriture sur
+# les RDV, patients ou utilisateurs appelle invalider_statistiques().
+
+
+def _compte_si(condition, poids=1):
+    return func.coalesce(func.sum(case((condition, poids), else_=0)), 0)
+
+
+# =======================================================
+# MISE À JOUR INCRÉMENTALE DE daily_stats
+# =======================================================
+def _incrementer(clinique_id, medecin_id, jour, statut, delta):
+    """Ajoute delta au compteur (upsert atomique sur SQLite et PostgreSQL)"""
+    cle = dict(clinique_id=clinique_id, medecin_id=medecin_id, date=jour, statut=statut)
+    dialecte = db.engine.dialect.name
+    if dialecte in ('sqlite', 'postgresql'):
+        insert = sqlite_insert if dialecte == 'sqlite' else postgresql_insert
+        stmt = insert(DailyStat).values(nombre=delta, **cle)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(cle),
+            set_={'nombre': DailyStat.nombre + stmt.excluded.nombre}
+        )
+        db.session.execute(stmt)
+        return
+
+    maj = db.session.execute(
+        db.update(DailyStat).filter_by(**cle).values(nombre=DailyStat.nombre + delta)
+    )
+    if maj.rowcount == 0:
+        db.session.execute(db.insert(DailyStat).values(nombre=delta, **cle))
+
+
+def ajouter_rdv_stats(rdv):
+    """À appeler dans la transaction qui crée le RDV (avant le commit)"""
+    _incrementer(rdv.clinique_id, int(rdv.medecin_id), rdv.date, rdv.statut or 'confirme', 1)
+
+
+def changer_statut_rdv(rdv, statut):
+    """Change le statut d'un RDV et met à jour daily_stats (le commit reste à l'appelant)"""
+    ancien = rdv.statut or 'confirme'
+    if ancien == statut:
+        return
+    rdv.statut = statut
+    _incrementer(rdv.clinique_id, rdv.medecin_id, rdv.date, ancien, -1)
+    _incrementer(rdv.clinique_id, rdv.medecin_id, rdv.date, statut, 1)
+
+
+def _comptes_reels():
+    """{(clinique_id, medecin_id, date, statut): nombre} recalculé depuis appointments"""
+    rows = db.session.query(
+        Appointment.clinique_id, Appointment.medecin_id, Appointment.date,
+        func.coalesce(Appointment.statut, 'confirme'), func.count(Appointment.id)
+    ).group_by(
+        Appointment.clinique_id, Appointment.medecin_id, Appointment.date,
+        func.coalesce(Appointment.statut, 'confirme')
+    )
+    return {(clinique_id, medecin_id, jour, statut): nombre
+            for clinique_id, medecin_id, jour, statut, nombre in rows}
+
+
+def reconcilier_daily_stats():
+    """
+    Compare daily_stats aux rendez-vous et corrige les écarts
+    (écriture directe en base, incrément perdu...). Retourne le nombre de
+    lignes corrigées.
+    """
+    reels = _comptes_reels()
+    stockes = {
+        (ligne.clinique_id, ligne.medecin_id, ligne.date, ligne.statut): ligne
+        for ligne in DailyStat.query
+    }
+
+    corrections = 0
+    for cle, ligne in stockes.items():
+        nombre = reels.get(cle, 0)
+        if nombre == 0:
+            # Les compteurs retombés à 0 sont supprimés sans compter comme un écart
+            if ligne.nombre:
+                corrections += 1
+            db.session.delete(ligne)
+        elif ligne.nombre != nombre:
+            ligne.nombre = nombre
+            corrections += 1
+    for (clinique_id, medecin_id, jour, statut), nombre in reels.items():
+        if (clinique_id, medecin_id, jour, statut) not in stockes:
+            db.session.add(DailyStat(clinique_id=clinique_id, medecin_id=medecin_id,
+                                     date=jour, statut=statut, nombre=nombre))
+            corrections += 1
+
+    db.session.commit()
+    return corrections
+
+
+# =======================================================
+# CACHE PAR CLINIQUE
+# =======================================================
+def _portee(clinique_id):
+    return 'global' if clinique_id is None else int(clinique_id)
+
+
+def invalider_statistiques(clinique_id=None):
+    """
+    À appeler après le commit de toute écriture sur les RDV, patients ou
+    utilisateurs d'une clinique ; la vue globale est toujours invalidée
+    """
+    cles = ['stats_version:global']
+    if clinique_id is not None:
+        cles.append(f"stats_version:{int(clinique_id)}")
+    cache.delete(*cles)
+
+
+def en_cache(nom, clinique_id, suffixe, calcul):
+    """
+    Résultat de calcul() (dictionnaire sérialisable en JSON) mis en cache
+    pour la clinique, invalidé par invalider_statistiques()
+    """
+    portee = _portee(clinique_id)
+    cle = f"stats:{portee}:{cache.version(f'stats_version:{portee}')}:{nom}:{suffixe}"
+    valeur = cache.get(cle)
+    if valeur is None:
+        valeur = calcul()
+        cache.set(cle, valeur, ttl=current_app.config.get('STATS_CACHE_TTL'))
+    # Copie : l'appelant peut compléter le dictionnaire sans toucher au cache mémoire
+    return dict(valeur)
+
+
+def compteurs_dashboard(clinique_id, today):
+    """Compteurs du tableau de bord (clinique_id=None : toutes les cliniques), mis en cache"""
+    return en_cache('dashboard', clinique_id, today.isoformat(),
+                    lambda: _calculer_compteurs_dashboard(clinique_id, today))
+
+
+def statistiques_admin(clinique_id, today, maintenant):
+    """Dictionnaire de la page Statistiques, mis en cache"""
+    return en_cache('statistiques', clinique_id, today.isoformat(),
+                    lambda: _calculer_statistiques_admin(clinique_id, today, maintenant))
+
+
+# =======================================================
+# LECTURE DES COMPTEURS
+# =======================================================
+def _calculer_compteurs_dashboard(clinique_id, today):
+    """Compteurs du tableau de bord en une seule requête"""
+    patients = db.session.query(func.count(Patient.id))
+    if clinique_id is not None:
+        patients = patients.filter(Patient.clinique_id == clinique_id)
+
+    nombre = DailyStat.nombre
+    query = db.session.query(
+        patients.scalar_subquery().label('total_patients'),
+        func.coalesce(func.sum(nombre), 0).label('total_rdv'),
+        _compte_si(DailyStat.date >= today.replace(day=1), nombre).label('total_rdv_mois'),
+        _compte_si(DailyStat.statut == 'annule', nombre).label('rdv_annules'),
+        _compte_si(DailyStat.statut == 'absent', nombre).label('rdv_absents'),
+        _compte_si(DailyStat.date == today, nombre).label('total_rdv_aujourdhui'),
+        _compte_si((DailyStat.date == today) & (DailyStat.statut == 'annule'), nombre).label('rdv_annules_aujourdhui')
+    )
+    if clinique_id is not None:
+        query = query.filter(DailyStat.clinique_id == clinique_id)
+
+    return query.one()._asdict()
+
+
+def _calculer_statistiques_admin(clinique_id, today, maintenant):
+    """
+    Dictionnaire de la page Statistiques, en une requête par table
+    Les RDV sont groupés par statut : les totaux par statut, du mois et du
+    jour se déduisent des mêmes lignes.
+    """
+    debut_mois = today.replace(day=1)
+
+    users = db.session.query(
+        _compte_si(User.role == 'medecin').label('medecins'),
+        _compte_si((User.role == 'medecin') & (User.actif == True)).label('medecins_actifs'),
+        _compte_si(User.role == 'secretaire').label('secretaires')
+    )
+    patients = db.session.query(
+        func.count(Patient.id).label('patients'),
+        _compte_si(Patient.date_creation >= debut_mois).label('nouveaux_patients')
+    )
+    rdvs = db.session.query(
+        DailyStat.statut,
+        func.sum(DailyStat.nombre),
+        _compte_si(DailyStat.date >= debut_mois, DailyStat.nombre),
+        _compte_si(DailyStat.date == today, DailyStat.nombre)
+    ).group_by(DailyStat.statut)
+    if clinique_id is not None:
+        users = users.filter(User.clinique_id == clinique_id)
+        patients = patients.filter(Patient.clinique_id == clinique_id)
+        rdvs = rdvs.filter(DailyStat.clinique_id == clinique_id)
+
+    stats = users.one()._asdict()
+    stats.update(patients.one()._asdict())
+
+    par_statut = {}
+    stats['rdv_mois'] = stats['rdv_aujourdhui'] = 0
+    for statut, total, du_mois, du_jour in rdvs:
+        par_statut[statut] = total
+        stats['rdv_mois'] += du_mois
+        stats['rdv_aujourdhui'] += du_jour
+    for statut in ('confirme', 'termine', 'annule', 'absent'):
+        stats[f'rdv_{statut}'] = par_statut.get(statut, 0)
+    stats['rdv_annules'] = stats['rdv_annule']
+
+    if clinique_id is None:
+        stats['abonnements_expires'] = Clinique.query.filter(
+            Clinique.date_fin_abonnement < maintenant
+        ).count()
+    return stats
+
+
+def statistiques_par_clinique(taille_lot=500):
+    """
+    Compteurs de chaque clinique en une seule requête : les sous-requêtes
+    groupées par clinique_id (médecins, patients, RDV par statut) sont
+    jointes aux cliniques. Les lignes sont lues par lots de taille_lot.
+    """
+    medecins = db.session.query(
+        User.clinique_id, func.count(User.id).label('nb')
+    ).filter(User.role == 'medecin').group_by(User.clinique_id).subquery()
+    patients = db.session.query(
+        Patient.clinique_id, func.count(Patient.id).label('nb')
+    ).group_by(Patient.clinique_id).subquery()
+    rdvs = db.session.query(
+        DailyStat.clinique_id,
+        func.sum(DailyStat.nombre).label('total'),
+        _compte_si(DailyStat.statut == 'confirme', DailyStat.nombre).label('confirme'),
+        _compte_si(DailyStat.statut == 'annule', DailyStat.nombre).label('annule'),
+        _compte_si(DailyStat.statut == 'absent', DailyStat.nombre).label('absent')
+    ).group_by(DailyStat.clinique_id).subquery()
+
+    return db.session.query(
+        Clinique.nom,
+        Clinique.date_fin_abonnement,
+        func.coalesce(medecins.c.nb, 0).label('medecins'),
+        func.coalesce(patients.c.nb, 0).label('patients'),
+        func.coalesce(rdvs.c.total, 0).label('rdv_total'),
+        func.coalesce(rdvs.c.confirme, 0).label('rdv_confirme'),
+        func.coalesce(rdvs.c.annule, 0).label('rdv_annule'),
+        func.coalesce(rdvs.c.absent, 0).label('rdv_absent')
+    ).outerjoin(medecins, medecins.c.clinique_id == Clinique.id
+    ).outerjoin(patients, patients.c.clinique_id == Clinique.id
+    ).outerjoin(rdvs, rdvs.c.clinique_id == Clinique.id
+    ).order_by(Clinique.id).execution_options(yield_per=taille_lot)
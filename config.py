@@ -19,6 +19,41 @@ class Config:
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max
     
+    # =======================================================
+    # CACHE (mémoire locale par défaut, Redis si REDIS_URL est défini)
+    # =======================================================
+    
+    REDIS_URL = os.environ.get('REDIS_URL')
+    CACHE_TAILLE_MAX = 10000  # Entrées max du cache mémoire (éviction LRU)
+    CRENEAUX_CACHE_TTL = 300  # Secondes ; filet de sécurité en plus de l'invalidation
+    STATS_CACHE_TTL = 60  # Secondes ; dashboard et page Statistiques
+    CALENDRIER_ETAG_TTL = 30  # Secondes ; borne un calendrier périmé entre workers sans Redis
+    
+    # =======================================================
+    # ÉVÉNEMENTS EN DIRECT (SSE)
+    # =======================================================
+    
+    # Flux /api/evenements ouverts simultanément par worker. Chacun occupe un
+    # thread (gunicorn --threads, 16 dans le Dockerfile) : garder une marge
+    # pour les autres requêtes. Au-delà, les pages passent au sondage.
+    SSE_FLUX_MAX = 8
+    
+    # Limite par utilisateur des API interrogées en continu par le calendrier
+    # et le dashboard (/api/rendez-vous, /api/disponibilites, /api/evenements),
+    # à la place des limites par IP ("50 per hour") : un onglet en sondage
+    # fait jusqu'à 240 requêtes par heure, 304 compris
+    LIMITE_API_TEMPS_REEL = "1200 per hour"
+    
+    # =======================================================
+    # RÉPONSES : JSON RAPIDE ET COMPRESSION
+    # =======================================================
+    
+    JSON_RAPIDE = True  # Sérialisation par orjson s'il est installé
+    COMPRESSION = True  # gzip (ou brotli si installé) selon Accept-Encoding
+    COMPRESSION_SEUIL = 1024  # Octets ; les réponses plus petites ne sont pas compressées
+    COMPRESSION_NIVEAU_GZIP = 6
+    COMPRESSION_NIVEAU_BROTLI = 4
+    
     # =======================================================
     # SÉCURITÉ DES COOKIES
     # =======================================================
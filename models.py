@@ -1,10 +1,65 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy.orm import validates
 from datetime import datetime
 import secrets
 
 db = SQLAlchemy()
 
+
+# =======================================================
+# HEURES EN MINUTES DEPUIS MINUIT
+# =======================================================
+# Les heures sont stockées en entiers (minutes depuis minuit) : la base peut
+# comparer et chercher des plages horaires, et les templates continuent
+# d'utiliser les propriétés "HH:MM" (rdv.heure, dispo.heure_debut...).
+
+_HEURES = [f"{m // 60:02d}:{m % 60:02d}" for m in range(24 * 60)]
+
+
+def heure_en_minutes(heure):
+    """Convertit "HH:MM" en minutes depuis minuit"""
+    h, m = heure.split(':')[:2]
+    return int(h) * 60 + int(m)
+
+
+def minutes_en_heure(minutes):
+    """Convertit des minutes depuis minuit en "HH:MM" """
+    if 0 <= minutes < 24 * 60:
+        return _HEURES[minutes]
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+# Durée maximale d'un RDV (minutes) : borne aussi la recherche de
+# chevauchements dans l'index (medecin_id, date, debut)
+DUREE_MAX_RDV = 240
+
+
+class PlageHoraireMixin:
+    """Accès "HH:MM" aux colonnes debut / fin (en minutes), durée des RDV bornée"""
+    
+    @validates('duree_rdv')
+    def valider_duree_rdv(self, cle, duree):
+        if duree is not None and not 1 <= int(duree) <= DUREE_MAX_RDV:
+            raise ValueError(f"Durée de RDV invalide : {duree} (entre 1 et {DUREE_MAX_RDV} minutes)")
+        return duree
+    
+    @property
+    def heure_debut(self):
+        return minutes_en_heure(self.debut) if self.debut is not None else None
+    
+    @heure_debut.setter
+    def heure_debut(self, valeur):
+        self.debut = heure_en_minutes(valeur)
+    
+    @property
+    def heure_fin(self):
+        return minutes_en_heure(self.fin) if self.fin is not None else None
+    
+    @heure_fin.setter
+    def heure_fin(self, valeur):
+        self.fin = heure_en_minutes(valeur)
+
 # =======================================================
 # MODÈLE CLINIQUE (avec gestion abonnement)
 # =======================================================
@@ -70,10 +125,19 @@ class User(UserMixin, db.Model):
 # =======================================================
 class Patient(db.Model):
     __tablename__ = 'patients'
+    __table_args__ = (
+        db.Index('ix_patients_clinique_nom', 'clinique_id', 'nom'),
+        db.Index('ix_patients_clinique_date_creation', 'clinique_id', 'date_creation'),
+        db.Index('ix_patients_telephone', 'telephone'),
+        db.Index('uq_patients_clinique_telephone_norm', 'clinique_id', 'telephone_norm', unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     nom = db.Column(db.String(100), nullable=False)
     telephone = db.Column(db.String(20), nullable=False)
+    # Téléphone au format E.164, rempli à chaque écriture de telephone :
+    # identifie le patient dans sa clinique (index unique)
+    telephone_norm = db.Column(db.String(20))
     email = db.Column(db.String(100))
     date_naissance = db.Column(db.Date)
     adresse = db.Column(db.String(200))
@@ -89,6 +153,13 @@ class Patient(db.Model):
     # Relations
     appointments = db.relationship('Appointment', backref='patient', lazy=True)
     prescriptions = db.relationship('Prescription', backref='patient', lazy=True)
+    
+    @validates('telephone')
+    def _normaliser_telephone(self, key, telephone):
+        # Import local : le paquet app importe ce module
+        from app.utils.sms_utils import telephone_e164
+        self.telephone_norm = telephone_e164(telephone)
+        return telephone
 
 
 # =======================================================
@@ -96,12 +167,25 @@ class Patient(db.Model):
 # =======================================================
 class Appointment(db.Model):
     __tablename__ = 'appointments'
+    __table_args__ = (
+        # Créneaux pris d'un médecin (disponibilités, réservation)
+        db.Index('ix_appointments_medecin_date_statut', 'medecin_id', 'date', 'statut'),
+        # Dashboard et calendrier d'une clinique
+        db.Index('ix_appointments_clinique_date', 'clinique_id', 'date'),
+        # Détection des chevauchements (plage de debut pour un médecin et un jour)
+        db.Index('ix_appointments_medecin_date_debut', 'medecin_id', 'date', 'debut'),
+        # Un seul RDV confirmé par créneau : garanti par la base, même entre workers
+        db.Index('uq_appointments_creneau_confirme', 'medecin_id', 'date', 'debut', unique=True,
+                 sqlite_where=db.text("statut = 'confirme'"),
+                 postgresql_where=db.text("statut = 'confirme'")),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=False)
     medecin_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     date = db.Column(db.Date, nullable=False)
-    heure = db.Column(db.String(5), nullable=False)
+    debut = db.Column(db.Integer, nullable=False)  # Minutes depuis minuit
+    duree = db.Column(db.Integer, nullable=False, default=30)  # Minutes, fixée à la réservation
     motif = db.Column(db.String(200))
     statut = db.Column(db.String(20), default='confirme')
     notes = db.Column(db.Text)
@@ -116,25 +200,111 @@ class Appointment(db.Model):
     
     # Relations
     prescription = db.relationship('Prescription', backref='appointment', uselist=False, lazy=True)
+    
+    @property
+    def heure(self):
+        """Heure du RDV au format "HH:MM" """
+        return minutes_en_heure(self.debut) if self.debut is not None else None
+    
+    @heure.setter
+    def heure(self, valeur):
+        self.debut = heure_en_minutes(valeur)
+    
+    @property
+    def heure_fin(self):
+        """Heure de fin du RDV au format "HH:MM" """
+        return minutes_en_heure(self.debut + (self.duree or 30)) if self.debut is not None else None
+
+
+# =======================================================
+# STATISTIQUES JOURNALIÈRES (agrégat des rendez-vous)
+# =======================================================
+class DailyStat(db.Model):
+    """Nombre de RDV par (clinique, médecin, jour, statut), tenu à jour à chaque écriture"""
+    __tablename__ = 'daily_stats'
+    
+    clinique_id = db.Column(db.Integer, db.ForeignKey('cliniques.id'), primary_key=True)
+    medecin_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    statut = db.Column(db.String(20), primary_key=True)
+    nombre = db.Column(db.Integer, nullable=False, default=0)
 
 
 # =======================================================
 # MODÈLE DISPONIBILITÉS
 # =======================================================
-class Availability(db.Model):
+class Availability(PlageHoraireMixin, db.Model):
     __tablename__ = 'availability'
+    __table_args__ = (
+        db.Index('ix_availability_medecin_date', 'medecin_id', 'date'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     medecin_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     date = db.Column(db.Date, nullable=False)
-    heure_debut = db.Column(db.String(5), nullable=False)
-    heure_fin = db.Column(db.String(5), nullable=False)
+    debut = db.Column(db.Integer, nullable=False)  # Minutes depuis minuit
+    fin = db.Column(db.Integer, nullable=False)
     duree_rdv = db.Column(db.Integer, default=30)
     
     # Lien vers clinique
     clinique_id = db.Column(db.Integer, db.ForeignKey('cliniques.id'), nullable=False)
 
 
+# =======================================================
+# MODÈLE RÈGLES DE DISPONIBILITÉ RÉCURRENTES
+# =======================================================
+class AvailabilityRule(PlageHoraireMixin, db.Model):
+    """Ex : lun-ven 09:00-12:00, RDV de 15 min, jusqu'au 30/06 (développée à la demande)"""
+    __tablename__ = 'availability_rules'
+    __table_args__ = (
+        db.Index('ix_availability_rules_medecin_dates', 'medecin_id', 'date_debut', 'date_fin'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    medecin_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    # Masque des jours : bit 0 = lundi ... bit 6 = dimanche
+    jours_semaine = db.Column(db.Integer, nullable=False)
+    debut = db.Column(db.Integer, nullable=False)  # Minutes depuis minuit
+    fin = db.Column(db.Integer, nullable=False)
+    duree_rdv = db.Column(db.Integer, default=30)
+    date_debut = db.Column(db.Date, nullable=False)
+    date_fin = db.Column(db.Date)  # NULL = sans date de fin
+    date_creation = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Lien vers clinique
+    clinique_id = db.Column(db.Integer, db.ForeignKey('cliniques.id'), nullable=False)
+    
+    doctor = db.relationship('User', lazy=True)
+    
+    @property
+    def jours(self):
+        """Numéros des jours concernés (0 = lundi)"""
+        return [j for j in range(7) if self.jours_semaine >> j & 1]
+
+
+# =======================================================
+# MODÈLE EXCEPTIONS (congés, absences, jours fériés)
+# =======================================================
+class AvailabilityException(db.Model):
+    """Période où les règles récurrentes ne s'appliquent pas"""
+    __tablename__ = 'availability_exceptions'
+    __table_args__ = (
+        db.Index('ix_availability_exceptions_clinique_dates', 'clinique_id', 'date_debut', 'date_fin'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    # NULL = toute la clinique (jour férié, fermeture)
+    medecin_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    date_debut = db.Column(db.Date, nullable=False)
+    date_fin = db.Column(db.Date, nullable=False)
+    motif = db.Column(db.String(200))
+    
+    # Lien vers clinique
+    clinique_id = db.Column(db.Integer, db.ForeignKey('cliniques.id'), nullable=False)
+    
+    doctor = db.relationship('User', lazy=True)
+
+
 # =======================================================
 # MODÈLE PRESCRIPTION
 # =======================================================
@@ -0,0 +1,91 @@
+import itertools
+from contextlib import contextmanager
+from types import SimpleNamespace
+import pytest
+from sqlalchemy import event
+from app import create_app
+from models import db, Clinique, User
+
+_numeros = itertools.count(1)
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    """Application sur une base SQLite fichier (partagée entre threads, comme en production)"""
+    dossier = tmp_path_factory.mktemp('clinique')
+    return create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{dossier / 'test.db'}",
+        # Attente du verrou d'écriture plus longue que les 5 s par défaut : les
+        # tests de concurrence sérialisent des centaines de réservations
+        'SQLALCHEMY_ENGINE_OPTIONS': {'connect_args': {'timeout': 60}, 'pool_size': 20, 'max_overflow': 0},
+        'UPLOAD_FOLDER': str(dossier / 'uploads'),
+        'WTF_CSRF_ENABLED': False,
+        'RATELIMIT_ENABLED': False,
+        'MAIL_SUPPRESS_SEND': True,
+        'INFOBIP_API_KEY': None,
+    })
+
+
+@pytest.fixture
+def creer_clinique(request):
+    """
+    creer_clinique(app=None) -> une clinique neuve avec un médecin et une
+    secrétaire (admin_clinique), dans l'application de test commune par défaut
+    """
+    return lambda app=None: _nouvelle_clinique(app or request.getfixturevalue('app'))
+
+
+@pytest.fixture
+def clinique(creer_clinique):
+    return creer_clinique()
+
+
+def _nouvelle_clinique(app):
+    n = next(_numeros)
+    with app.app_context():
+        c = Clinique(nom=f'Clinique {n}', slug=f'clinique-{n}')
+        db.session.add(c)
+        db.session.flush()
+        medecin = User(nom=f'Dr Test {n}', email=f'medecin{n}@test.sn', mot_de_passe_hash='x',
+                       role='medecin', clinique_id=c.id, specialite='Généraliste')
+        secretaire = User(nom=f'Secrétaire {n}', email=f'secretaire{n}@test.sn', mot_de_passe_hash='x',
+                          role='admin_clinique', clinique_id=c.id)
+        db.session.add_all([medecin, secretaire])
+        db.session.commit()
+        return SimpleNamespace(id=c.id, slug=c.slug, medecin_id=medecin.id, secretaire_id=secretaire.id)
+
+
+@pytest.fixture
+def connecter(request):
+    """connecter(user_id, app=None) -> client de test avec une session ouverte pour cet utilisateur"""
+    def _connecter(user_id, app=None):
+        client = (app or request.getfixturevalue('app')).test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        return client
+    return _connecter
+
+
+@pytest.fixture
+def compteur_requetes(app):
+    """
+    with compteur_requetes() as compte: ... -> compte.total instructions SQL
+    envoyées à la base pendant le bloc (before_cursor_execute)
+    """
+    @contextmanager
+    def _compteur():
+        compte = SimpleNamespace(total=0)
+
+        def compter(*args):
+            compte.total += 1
+
+        with app.app_context():
+            moteur = db.engine
+        event.listen(moteur, 'before_cursor_execute', compter)
+        try:
+            yield compte
+        finally:
+            event.remove(moteur, 'before_cursor_execute', compter)
+    return _compteur
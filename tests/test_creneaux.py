@@ -0,0 +1,86 @@
+import pytest
+from datetime import date
+from models import db, Appointment, Availability, AvailabilityRule
+
+# =======================================================
+# CONFIGURATION DES DISPONIBILITÉS
+# =======================================================
+
+
+def messages_flash(client):
+    with client.session_transaction() as session:
+        return [message for _, message in session.get('_flashes', [])]
+
+
+@pytest.mark.parametrize('duree', ['0', '-15', '241'])
+def test_duree_rdv_hors_bornes_refusee(app, clinique, connecter, duree):
+    client = connecter(clinique.medecin_id)
+    client.post('/creneaux/ajouter', data={
+        'date': '2030-04-01', 'date_fin': '2030-04-05',
+        'heure_debut': '09:00', 'heure_fin': '12:00', 'duree_rdv': duree,
+    })
+    client.post('/creneaux/regles/ajouter', data={
+        'jours': ['0', '2'], 'heure_debut': '09:00', 'heure_fin': '12:00',
+        'duree_rdv': duree, 'date_debut': '2030-04-01',
+    })
+
+    assert messages_flash(client) == ['Durée de RDV invalide (entre 1 et 240 minutes)'] * 2
+    with app.app_context():
+        assert Availability.query.filter_by(medecin_id=clinique.medecin_id).count() == 0
+        assert AvailabilityRule.query.filter_by(medecin_id=clinique.medecin_id).count() == 0
+        # Même borne dans le modèle
+        with pytest.raises(ValueError):
+            Availability(duree_rdv=int(duree))
+
+
+def test_duree_rdv_valide_acceptee(app, clinique, connecter):
+    client = connecter(clinique.medecin_id)
+    client.post('/creneaux/ajouter', data={
+        'date': '2030-04-01', 'heure_debut': '09:00', 'heure_fin': '12:00', 'duree_rdv': '240',
+    })
+    with app.app_context():
+        assert [d.duree_rdv for d in Availability.query.filter_by(medecin_id=clinique.medecin_id)] == [240]
+
+
+
+# =======================================================
+# ABSENCES ET FERMETURES
+# =======================================================
+def creneaux(client, clinique, jour):
+    """Créneaux du jour par les trois chemins : journée, période, page publique"""
+    journee = client.get(f'/rendez-vous/disponibilites/{clinique.medecin_id}/{jour}').get_json()['creneaux']
+    periode = client.get(f'/api/creneaux?medecins={clinique.medecin_id}&from={jour}&to={jour}').get_json()
+    return journee, periode['creneaux'][str(clinique.medecin_id)].get(jour, [])
+
+
+@pytest.mark.parametrize('toute_clinique', [False, True])
+def test_exception_retire_les_disponibilites_ponctuelles(app, clinique, connecter, toute_clinique):
+    """Une absence (ou une fermeture) s'applique aussi aux disponibilités ponctuelles déjà saisies"""
+    with app.app_context():
+        db.session.add(Availability(medecin_id=clinique.medecin_id, clinique_id=clinique.id, date=date(2030, 5, 6),
+                                    debut=9 * 60, fin=12 * 60, duree_rdv=45))
+        db.session.commit()
+    medecin = connecter(clinique.medecin_id)
+    secretaire = connecter(clinique.secretaire_id)
+
+    # Créneaux offerts (et mis en cache) avant l'absence
+    assert creneaux(secretaire, clinique, '2030-05-06') == (['09:00', '09:45', '10:30', '11:15'],) * 2
+
+    auteur = secretaire if toute_clinique else medecin
+    auteur.post('/creneaux/exceptions/ajouter', data={
+        'date_debut': '2030-05-06', 'date_fin': '2030-05-06', 'motif': 'Congé',
+        'toute_clinique': '1' if toute_clinique else '',
+    })
+    assert creneaux(secretaire, clinique, '2030-05-06') == ([], [])
+
+    # Réservation directe refusée, par la secrétaire comme en ligne
+    secretaire.post('/rendez-vous/reserver', data={
+        'medecin_id': clinique.medecin_id, 'patient_nom': 'Awa', 'patient_tel': '775550001',
+        'date': '2030-05-06', 'heure': '09:00',
+    })
+    app.test_client().post(f'/{clinique.slug}/reserver', data={
+        'medecin_id': clinique.medecin_id, 'patient_nom': 'Moussa', 'patient_tel': '775550002',
+        'date': '2030-05-06', 'heure': '10:30',
+    })
+    with app.app_context():
+        assert Appointment.query.filter_by(medecin_id=clinique.medecin_id).count() == 0
@@ -0,0 +1,44 @@
+import pytest
+from app import create_app
+
+# =======================================================
+# LIMITES DE REQUÊTES DES API EN TEMPS RÉEL
+# =======================================================
+# L'application de test commune désactive Flask-Limiter ; celle-ci l'active,
+# avec les limites par défaut de production ("50 per hour" par IP).
+
+
+@pytest.fixture(scope='module')
+def app_limitee(tmp_path_factory):
+    dossier = tmp_path_factory.mktemp('limites')
+    return create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{dossier / 'test.db'}",
+        'UPLOAD_FOLDER': str(dossier / 'uploads'),
+        'WTF_CSRF_ENABLED': False,
+        'RATELIMIT_ENABLED': True,
+        'RATELIMIT_STORAGE_URI': 'memory://',
+        'MAIL_SUPPRESS_SEND': True,
+        'INFOBIP_API_KEY': None,
+    })
+
+
+def test_sondage_du_calendrier_au_dela_des_limites_par_ip(app_limitee, creer_clinique, connecter):
+    """Deux utilisateurs de la même clinique (même IP) sondent le calendrier : jamais de 429"""
+    clinique = creer_clinique(app_limitee)
+    clients = [connecter(user_id, app_limitee) for user_id in (clinique.medecin_id, clinique.secretaire_id)]
+
+    # Une heure de sondage d'un onglet (2 requêtes toutes les 30 s), pour chacun
+    for client in clients:
+        etag = None
+        for i in range(120):
+            url = '/api/rendez-vous' if i % 2 else '/api/disponibilites'
+            reponse = client.get(f'{url}?start=2030-01-01&end=2030-02-01',
+                                 headers={'If-None-Match': etag} if etag and i % 2 else {})
+            assert reponse.status_code in (200, 304), (i, reponse.status_code)
+            if i % 2:
+                etag = reponse.headers['ETag']
+
+    # Les autres pages gardent les limites par défaut
+    statuts = [clients[0].get('/calendrier').status_code for _ in range(51)]
+    assert statuts == [200] * 50 + [429]
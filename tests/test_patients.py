@@ -0,0 +1,52 @@
+import pytest
+from sqlalchemy import text
+from models import db
+from app.utils import migrations
+from app.utils.migrations import MigrationReportee, appliquer_migrations
+from app.utils.patients import obtenir_ou_creer_patient
+
+# =======================================================
+# RECHERCHE DES PATIENTS ET MIGRATIONS REPORTÉES
+# =======================================================
+
+
+def _reportee(conn):
+    raise MigrationReportee("extensions indisponibles")
+
+
+def test_migrations_suivantes_appliquees_apres_report(app, monkeypatch):
+    monkeypatch.setattr(migrations, 'MIGRATIONS', [
+        (version, description, _reportee if version == '007' else migration)
+        for version, description, migration in migrations.MIGRATIONS
+    ])
+    with app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(text("DELETE FROM schema_migrations WHERE version IN ('007', '008', '009')"))
+        try:
+            appliquees = appliquer_migrations()
+
+            assert {'008', '009'} <= appliquees and '007' not in appliquees
+            with db.engine.connect() as conn:
+                enregistrees = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+            assert enregistrees == appliquees
+        finally:
+            monkeypatch.undo()
+            appliquer_migrations()
+
+
+@pytest.mark.parametrize('index_plein_texte', [True, False])
+def test_recherche_patients(app, clinique, connecter, monkeypatch, index_plein_texte):
+    with app.app_context():
+        obtenir_ou_creer_patient(clinique.id, 'Aïssatou Ndiaye', '77 123 45 67')
+        obtenir_ou_creer_patient(clinique.id, 'Moussa Diop', '78 765 43 21')
+        db.session.commit()
+    if not index_plein_texte:
+        # Migration 007 reportée (ex. PostgreSQL sans pg_trgm)
+        monkeypatch.setitem(app.extensions, 'migrations_appliquees',
+                            app.extensions['migrations_appliquees'] - {'007'})
+
+    client = connecter(clinique.secretaire_id)
+    reponse = client.get('/api/patients', query_string={'search': 'ndiaye'})
+
+    assert reponse.status_code == 200
+    assert [p['nom'] for p in reponse.get_json()['patients']] == ['Aïssatou Ndiaye']
@@ -0,0 +1,73 @@
+from datetime import date, timedelta
+from models import db, User, Patient, Appointment
+from app.utils.statistiques import ajouter_rdv_stats
+
+# =======================================================
+# NOMBRE DE REQUÊTES PAR PAGE
+# =======================================================
+# Le nombre d'instructions SQL d'une page ne doit pas dépendre du nombre
+# de rendez-vous affichés (pas de chargement paresseux ligne par ligne).
+
+
+def creer_rdv(app, clinique, nombre, jours):
+    """nombre RDV confirmés, répartis sur deux médecins et autant de patients, sur les jours donnés"""
+    with app.app_context():
+        autre = User(nom=f'Dr Second {clinique.id}', email=f'second{clinique.id}@test.sn', mot_de_passe_hash='x',
+                     role='medecin', clinique_id=clinique.id)
+        patients = [Patient(nom=f'Patient {i}', telephone=f'70{clinique.id:03d}{i:04d}', clinique_id=clinique.id)
+                    for i in range(nombre)]
+        db.session.add(autre)
+        db.session.add_all(patients)
+        db.session.flush()
+        for i, patient in enumerate(patients):
+            rdv = Appointment(patient_id=patient.id, medecin_id=(clinique.medecin_id, autre.id)[i % 2],
+                              clinique_id=clinique.id, date=jours[i % len(jours)], debut=8 * 60 + (i // 2) * 15,
+                              duree=15, statut='confirme', motif='Consultation')
+            db.session.add(rdv)
+            ajouter_rdv_stats(rdv)
+        db.session.commit()
+
+
+def requetes_dashboard(clinique, connecter, compteur_requetes):
+    client = connecter(clinique.secretaire_id)
+    with compteur_requetes() as compte:
+        reponse = client.get('/dashboard')
+    assert reponse.status_code == 200
+    return compte.total
+
+
+def test_dashboard_nombre_de_requetes_constant(app, clinique, creer_clinique, connecter, compteur_requetes):
+    aujourdhui = date.today()
+    creer_rdv(app, clinique, 2, [aujourdhui])
+    peu = requetes_dashboard(clinique, connecter, compteur_requetes)
+
+    # Une autre clinique avec 30 fois plus de RDV (aujourd'hui et à venir)
+    grande = creer_clinique()
+    creer_rdv(app, grande, 60, [aujourdhui, aujourdhui + timedelta(days=1)])
+    beaucoup = requetes_dashboard(grande, connecter, compteur_requetes)
+
+    assert peu == beaucoup
+    assert beaucoup <= 4
+
+
+def requetes_calendrier(clinique, connecter, compteur_requetes, debut, fin):
+    client = connecter(clinique.secretaire_id)
+    with compteur_requetes() as compte:
+        reponse = client.get(f'/api/rendez-vous?start={debut.isoformat()}&end={fin.isoformat()}')
+    assert reponse.status_code == 200
+    return compte.total, len(reponse.get_json())
+
+
+def test_api_rendez_vous_nombre_de_requetes_constant(app, clinique, creer_clinique, connecter, compteur_requetes):
+    debut = date(2030, 6, 1)
+    fin = date(2030, 6, 30)
+    creer_rdv(app, clinique, 2, [debut])
+    peu, nombre_peu = requetes_calendrier(clinique, connecter, compteur_requetes, debut, fin)
+
+    grande = creer_clinique()
+    creer_rdv(app, grande, 200, [debut + timedelta(days=i) for i in range(20)])
+    beaucoup, nombre_beaucoup = requetes_calendrier(grande, connecter, compteur_requetes, debut, fin)
+
+    assert (nombre_peu, nombre_beaucoup) == (2, 200)
+    # Chargement de l'utilisateur connecté, puis une seule requête jointe
+    assert peu == beaucoup == 2
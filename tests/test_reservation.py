@@ -0,0 +1,85 @@
+import threading
+from datetime import date
+from models import db, Appointment, Availability, Patient
+
+# =======================================================
+# RÉSERVATIONS CONCURRENTES
+# =======================================================
+# Chaque demande part de son propre thread et de son propre client, comme
+# des requêtes simultanées sur plusieurs threads d'un worker gunicorn.
+
+
+def reserver_en_parallele(app, slug, demandes):
+    """POST simultanés sur /<slug>/reserver ; retourne les messages flash de chaque demande"""
+    depart = threading.Barrier(len(demandes))
+    messages = [None] * len(demandes)
+
+    def reserver(i, formulaire):
+        client = app.test_client()
+        depart.wait()
+        reponse = client.post(f'/{slug}/reserver', data=formulaire)
+        assert reponse.status_code == 302
+        with client.session_transaction() as session:
+            messages[i] = [message for _, message in session.get('_flashes', [])]
+
+    threads = [threading.Thread(target=reserver, args=(i, formulaire)) for i, formulaire in enumerate(demandes)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return messages
+
+
+def rdv_confirmes(app, medecin_id):
+    with app.app_context():
+        return Appointment.query.filter_by(medecin_id=medecin_id, statut='confirme').all()
+
+
+def test_reservations_simultanees_meme_creneau(app, clinique):
+    """300 patients différents visent le même créneau : un seul RDV confirmé"""
+    demandes = [{
+        'medecin_id': clinique.medecin_id,
+        'patient_nom': f'Patient {i}',
+        'patient_tel': f'77{i:07d}',
+        'date': '2030-03-04',
+        'heure': '09:00',
+    } for i in range(300)]
+
+    messages = reserver_en_parallele(app, clinique.slug, demandes)
+
+    assert len(rdv_confirmes(app, clinique.medecin_id)) == 1
+    confirmes = [m for m in messages if any('confirmé' in texte for texte in m)]
+    refuses = [m for m in messages if any("n'est plus disponible" in texte for texte in m)]
+    assert len(confirmes) == 1
+    autres = [m for m in messages if m not in confirmes and m not in refuses]
+    assert not autres, autres[:3]
+    assert len(refuses) == 299
+
+
+def test_reservations_simultanees_creneaux_qui_se_chevauchent(app, clinique):
+    """Débuts différents mais chevauchants (plage de 45 min) : aucun RDV confirmé ne se chevauche"""
+    with app.app_context():
+        db.session.add(Availability(medecin_id=clinique.medecin_id, clinique_id=clinique.id, date=date(2030, 3, 5),
+                                    debut=9 * 60, fin=9 * 60 + 45, duree_rdv=45))
+        # Patients existants : seule la vérification du créneau est en jeu
+        patients = [Patient(nom=f'Patient {i}', telephone=f'76{i:07d}', clinique_id=clinique.id) for i in range(80)]
+        db.session.add_all(patients)
+        db.session.commit()
+        telephones = [patient.telephone for patient in patients]
+
+    heures = ['09:00', '09:15', '09:30', '10:00']
+    demandes = [{
+        'medecin_id': clinique.medecin_id,
+        'patient_nom': f'Patient {i}',
+        'patient_tel': telephone,
+        'date': '2030-03-05',
+        'heure': heures[i % len(heures)],
+    } for i, telephone in enumerate(telephones)]
+
+    messages = reserver_en_parallele(app, clinique.slug, demandes)
+    assert all(len(m) == 1 and ('confirmé' in m[0] or "n'est plus disponible" in m[0]) for m in messages)
+
+    rdvs = sorted(rdv_confirmes(app, clinique.medecin_id), key=lambda rdv: rdv.debut)
+    assert rdvs
+    for precedent, suivant in zip(rdvs, rdvs[1:]):
+        assert precedent.debut + precedent.duree <= suivant.debut